@@ -29,10 +29,20 @@ class Cifar10DataSet(object):
   Described by http://www.cs.toronto.edu/~kriz/cifar.html.
   """
 
-    def __init__(self, data_dir, subset='train', use_distortion=True):
+    def __init__(self,
+                 data_dir,
+                 subset='train',
+                 use_distortion=True,
+                 num_examples=None,
+                 image_size=HEIGHT):
+        """If ``num_examples`` is given, only a fixed random subset of the
+        examples of that size is used. Images are resized to
+        ``image_size`` if it differs from the original size."""
         self.data_dir = data_dir
         self.subset = subset
         self.use_distortion = use_distortion
+        self.num_examples = num_examples
+        self.image_size = image_size
 
     def get_filenames(self):
         if self.subset in ['train', 'validation', 'eval']:
@@ -70,6 +80,12 @@ class Cifar10DataSet(object):
         filenames = self.get_filenames()
         # Repeat infinitely.
         dataset = tf.data.TFRecordDataset(filenames)
+        if self.num_examples is not None:
+            # the same subset is used every time.
+            dataset = dataset.shuffle(
+                Cifar10DataSet.num_examples_per_epoch(self.subset),
+                seed=0,
+                reshuffle_each_iteration=False).take(self.num_examples)
 
         # Parse records.
         dataset = dataset.map(self.parser, num_parallel_calls=2).cache()
@@ -82,6 +98,7 @@ class Cifar10DataSet(object):
             # shuffling.
             dataset = dataset.apply(
                 tf.data.experimental.shuffle_and_repeat(
+                    self.num_examples if self.num_examples is not None else
                     Cifar10DataSet.num_examples_per_epoch(self.subset)))
             # dataset = dataset.shuffle(
             #     buffer_size=min_queue_examples + 3 * batch_size,
@@ -106,6 +123,9 @@ class Cifar10DataSet(object):
             image = tf.image.resize_image_with_crop_or_pad(image, 40, 40)
             image = tf.random_crop(image, [HEIGHT, WIDTH, DEPTH])
             image = tf.image.random_flip_left_right(image)
+        if self.image_size != HEIGHT:
+            image = tf.image.resize_images(image,
+                                           [self.image_size, self.image_size])
         return image, label
 
     @staticmethod
@@ -1,3 +1,4 @@
+import threading
 from collections import OrderedDict
 from six import iterkeys, itervalues, iteritems
 
@@ -95,15 +96,22 @@ class Scope:
         """
         return self.name_to_elem[name]
 
+    @staticmethod
+    def get_default_scope():
+        """Returns the default scope of the current thread, so that search
+        spaces can be built concurrently in different threads."""
+        if not hasattr(_thread_local, 'default_scope'):
+            _thread_local.default_scope = Scope()
+        return _thread_local.default_scope
+
     @staticmethod
     def reset_default_scope():
-        """Replaces the current default scope with a new empty scope."""
-        Scope.default_scope = Scope()
+        """Replaces the default scope of the current thread with a new empty
+        scope."""
+        _thread_local.default_scope = Scope()
 
 
-# NOTE: is this called once for each time core is imported?
-# TODO: check.
-Scope.default_scope = Scope()
+_thread_local = threading.local()
 
 
 class Addressable:
@@ -164,7 +172,7 @@ class Hyperparameter(Addressable):
     """
 
     def __init__(self, scope=None, name=None):
-        scope = scope if scope is not None else Scope.default_scope
+        scope = scope if scope is not None else Scope.get_default_scope()
         name = scope.get_unused_name('.'.join(
             ['H', (name if name is not None else self._get_base_name()) + '-']))
         Addressable.__init__(self, scope, name)
@@ -502,7 +510,7 @@ class Module(Addressable):
     """
 
     def __init__(self, scope=None, name=None):
-        scope = scope if scope is not None else Scope.default_scope
+        scope = scope if scope is not None else Scope.get_default_scope()
         name = scope.get_unused_name('.'.join(
             ['M', (name if name is not None else self._get_base_name()) + '-']))
         Addressable.__init__(self, scope, name)
@@ -75,6 +75,12 @@ class SubstitutionModule(co.Module):
             return a strict subset of the names of the outputs existing before the
             substitution. Otherwise, the dictionary of outputs returned by the
             substitution function must contain exactly the same output names.
+        joint_sampler_fn ((() -> dict[str, object]), optional): Function that
+            returns a random joint assignment of values to the hyperparameters
+            of the module, keyed by their local names, for which the
+            substitution function is valid. Searchers can use it to sample
+            the hyperparameters directly from the valid assignments rather
+            than rejecting invalid ones.
     """
 
     def __init__(self,
@@ -85,10 +91,12 @@ class SubstitutionModule(co.Module):
                  output_names,
                  scope=None,
                  allow_input_subset=False,
-                 allow_output_subset=False):
+                 allow_output_subset=False,
+                 joint_sampler_fn=None):
         co.Module.__init__(self, scope, name)
         self.allow_input_subset = allow_input_subset
         self.allow_output_subset = allow_output_subset
+        self.joint_sampler_fn = joint_sampler_fn
 
         self._register(input_names, output_names, name_to_hyperp)
         self._substitution_fn = substitution_fn
@@ -178,7 +186,8 @@ def substitution_module(name,
                         output_names,
                         scope,
                         allow_input_subset=False,
-                        allow_output_subset=False):
+                        allow_output_subset=False,
+                        joint_sampler_fn=None):
     """Same as the substitution module, but directly works with the dictionaries of
     inputs and outputs.
 
@@ -213,6 +222,9 @@ def substitution_module(name,
             return a strict subset of the names of the outputs existing before the
             substitution. Otherwise, the dictionary of outputs returned by the
             substitution function must contain exactly the same output names.
+        joint_sampler_fn ((() -> dict[str, object]), optional): Function that
+            returns a random valid joint assignment of values to the
+            hyperparameters of the module, keyed by their local names.
 
     Returns:
         (dict[str,deep_architect.core.Input], dict[str,deep_architect.core.Output]):
@@ -225,7 +237,8 @@ def substitution_module(name,
                               output_names,
                               scope,
                               allow_input_subset=allow_input_subset,
-                              allow_output_subset=allow_output_subset).get_io()
+                              allow_output_subset=allow_output_subset,
+                              joint_sampler_fn=joint_sampler_fn).get_io()
 
 
 def _get_name(name, default_name):
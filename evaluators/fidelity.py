@@ -0,0 +1,76 @@
+import deep_architect.core as co
+import deep_architect.hyperparameters as hp
+
+# evaluation at full fidelity. the number of training epochs is the budget of
+# the evaluator if it is None.
+FULL_FIDELITY = {
+    'train_fraction': 1.0,
+    'num_training_epochs': None,
+    'image_size': 32,
+    'channel_multiplier': 1.0,
+}
+
+
+def get_fidelity(fidelity=None):
+    """Returns the fidelity configuration with defaults for the missing keys.
+
+    Args:
+        fidelity (dict[str, object]): Possibly partial fidelity configuration
+            with the keys of :data:`FULL_FIDELITY`:
+
+            - ``train_fraction``: fraction of the training set used.
+            - ``num_training_epochs``: number of training epochs.
+            - ``image_size``: size to which the images are resized.
+            - ``channel_multiplier``: multiplier of the number of filters of
+              the search space (see :func:`build_architecture`).
+
+    Returns:
+        dict[str, object]: Full fidelity configuration.
+    """
+    d = dict(FULL_FIDELITY)
+    if fidelity is not None:
+        for k in fidelity:
+            if k not in FULL_FIDELITY:
+                raise ValueError('Unknown fidelity key: %s' % k)
+        d.update(fidelity)
+    return d
+
+
+def is_full_fidelity(fidelity):
+    fidelity = get_fidelity(fidelity)
+    return all(fidelity[k] == v
+               for k, v in FULL_FIDELITY.items()
+               if k != 'num_training_epochs')
+
+
+def build_architecture(search_space_factory_fn, hyperp_value_lst,
+                       channel_multiplier=1.0):
+    """Builds the architecture given by the hyperparameter values with a
+    channel multiplier.
+
+    The numbers of filters in the search spaces are hyperparameters with a
+    single value that depends on the channel multiplier, so values sampled
+    at one channel multiplier can be replayed at any other. Hyperparameters
+    with a single value get that value, rather than the one in the list.
+
+    Args:
+        search_space_factory_fn ((float) -> deep_architect.modules.SearchSpaceFactory):
+            Function that returns the search space factory for a channel
+            multiplier (e.g., the search space factory class).
+        hyperp_value_lst (list[object]): Values that specify the architecture.
+        channel_multiplier (float): Multiplier of the number of filters.
+
+    Returns:
+        (dict[str, deep_architect.core.Input], dict[str, deep_architect.core.Output]):
+            Inputs and outputs of the architecture.
+    """
+    ssf = search_space_factory_fn(channel_multiplier=channel_multiplier)
+    inputs, outputs = ssf.get_search_space()
+    for i, h in enumerate(
+            co.unassigned_independent_hyperparameter_iterator(
+                outputs.values())):
+        if isinstance(h, hp.Discrete) and len(h.vs) == 1:
+            h.assign_value(h.vs[0])
+        else:
+            h.assign_value(hyperp_value_lst[i])
+    return inputs, outputs
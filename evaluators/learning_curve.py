@@ -0,0 +1,131 @@
+import numpy as np
+import scipy.optimize as opt
+import scipy.stats as stats
+
+
+def power_law(t, a, b, c):
+    return a - b * np.power(t, -c)
+
+
+class LearningCurvePredictor:
+    """Extrapolates a partial learning curve to the end of training.
+
+    Fits a saturating power law, ``acc(t) = a - b * t^(-c)``, to the
+    validation accuracies observed so far, and gives a confidence interval for
+    the accuracy at the final epoch by sampling the parameters from the
+    Gaussian approximation of the fit.
+
+    Args:
+        min_num_points (int): Minimum number of points of the curve for which
+            a prediction is made.
+        confidence (float): Probability mass of the confidence interval.
+        num_param_samples (int): Number of parameter samples used to compute
+            the confidence interval.
+        seed (int): Seed for the parameter samples.
+    """
+
+    def __init__(self,
+                 min_num_points=3,
+                 confidence=.95,
+                 num_param_samples=256,
+                 seed=0):
+        assert min_num_points >= 3
+        self.min_num_points = min_num_points
+        self.confidence = confidence
+        self.num_param_samples = num_param_samples
+        self.rand = np.random.RandomState(seed)
+
+    def predict(self, epochs, accuracies, final_epoch):
+        """Predicts the accuracy at the final epoch.
+
+        Args:
+            epochs (list[float]): Epochs at which the accuracies were measured.
+            accuracies (list[float]): Validation accuracies.
+            final_epoch (float): Epoch at which training ends.
+
+        Returns:
+            (float, float, float) or None: Predicted accuracy and lower and
+                upper ends of the confidence interval, or ``None`` if there
+                are not enough points or the fit fails.
+        """
+        if len(epochs) < self.min_num_points:
+            return None
+        t = np.asarray(epochs, dtype='float')
+        y = np.asarray(accuracies, dtype='float')
+        try:
+            params, cov = opt.curve_fit(power_law,
+                                        t,
+                                        y,
+                                        p0=[y[-1], y[-1] - y[0] + 1e-3, .5],
+                                        bounds=([0., 0., 0.], [1., 1e3, 5.]),
+                                        maxfev=2000)
+        except (RuntimeError, ValueError):
+            return None
+        # parameters that the curve does not determine (e.g., the rate of a
+        # flat curve) are kept fixed.
+        cov = np.where(np.isfinite(cov), cov, 0.)
+
+        samples = self.rand.multivariate_normal(params,
+                                                cov,
+                                                size=self.num_param_samples)
+        # the parameters are kept in the region where the power law saturates.
+        samples[:, 2] = np.maximum(samples[:, 2], 0.)
+        preds = np.clip(power_law(final_epoch, *samples.T), 0., 1.)
+        alpha = (1. - self.confidence) / 2.
+        lower, upper = np.percentile(preds, [100. * alpha, 100. * (1. - alpha)])
+        # widened by the noise of the measurements around the fit.
+        noise = stats.norm.ppf(1. - alpha) * np.std(y - power_law(t, *params))
+        pred = float(np.clip(power_law(final_epoch, *params), 0., 1.))
+        return (pred, float(max(lower - noise, 0.)),
+                float(min(upper + noise, 1.)))
+
+
+class TopKTracker:
+    """Keeps the ``k`` best final validation accuracies seen so far."""
+
+    def __init__(self, k):
+        self.k = k
+        self.vals = []
+
+    def update(self, val):
+        self.vals = sorted(self.vals + [val], reverse=True)[:self.k]
+
+    def get_threshold(self):
+        """Returns the k-th best accuracy, or ``None`` if there are fewer than
+        ``k`` accuracies."""
+        return self.vals[-1] if len(self.vals) == self.k else None
+
+
+class MedianStoppingRule:
+    """Stops runs whose learning curve falls below the median of the previous
+    learning curves.
+
+    A run is stopped at some epoch when the best accuracy of its learning
+    curve so far is lower than the median of the running averages of the
+    previous learning curves up to that epoch. Only previous curves that
+    reached that epoch are used.
+
+    Args:
+        min_num_curves (int): Minimum number of previous curves needed to
+            stop a run.
+    """
+
+    def __init__(self, min_num_curves=5):
+        self.min_num_curves = min_num_curves
+        self.curves = []
+
+    def add_curve(self, learning_curve):
+        if len(learning_curve) > 0:
+            self.curves.append(learning_curve)
+
+    def should_stop(self, learning_curve):
+        epoch = learning_curve[-1][0]
+        running_avgs = [
+            np.mean([acc for e, acc in curve if e <= epoch])
+            for curve in self.curves
+            if curve[-1][0] >= epoch
+        ]
+        if len(running_avgs) < self.min_num_curves:
+            return False
+        best_acc = max(acc for _, acc in learning_curve)
+        return best_acc < np.median(running_avgs)
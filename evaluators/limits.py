@@ -0,0 +1,104 @@
+import os
+import time
+
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'timeout'
+STATUS_OUT_OF_MEMORY = 'out_of_memory'
+STATUS_ERROR = 'error'
+STATUS_CRASHED = 'crashed'
+
+
+class EvaluationLimitExceeded(Exception):
+    """Raised when an evaluation goes over its time or memory limit.
+
+    Args:
+        status (str): :data:`STATUS_TIMEOUT` or :data:`STATUS_OUT_OF_MEMORY`.
+        cause (str): Description of the limit that was exceeded.
+    """
+
+    def __init__(self, status, cause):
+        Exception.__init__(self, cause)
+        self.status = status
+
+
+def get_rss_in_bytes(pid=None):
+    """Returns the resident set size of a process (by default, the current
+    one), or None if it is not available (it is read from ``/proc``)."""
+    try:
+        with open('/proc/%s/statm' % ('self' if pid is None else pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def get_exceeded_limit(deadline=None, max_rss_in_bytes=None, pid=None):
+    """Checks the limits of an evaluation running in a process.
+
+    Args:
+        deadline (float): Time (as returned by ``time.time``) by which the
+            evaluation must finish. Not checked if None.
+        max_rss_in_bytes (int): Maximum resident set size of the process. Not
+            checked if None.
+        pid (int): Process running the evaluation. By default, the current
+            one.
+
+    Returns:
+        (str, str): The status and the cause of the failure for the first
+            limit exceeded, or None if the evaluation is within its limits.
+    """
+    if deadline is not None and time.time() > deadline:
+        return STATUS_TIMEOUT, 'Deadline exceeded'
+    if max_rss_in_bytes is not None:
+        rss = get_rss_in_bytes(pid)
+        if rss is not None and rss > max_rss_in_bytes:
+            return STATUS_OUT_OF_MEMORY, (
+                'Resident memory of %d bytes exceeds the limit of %d bytes' %
+                (rss, max_rss_in_bytes))
+    return None
+
+
+def get_failure_results(status, cause, elapsed_time_in_seconds):
+    """Returns the results of a failed evaluation.
+
+    The validation accuracy is zero, so searchers can be updated with the
+    results of failed evaluations like with any others.
+    """
+    return {
+        'status': status,
+        'cause': cause,
+        'elapsed_time_in_seconds': elapsed_time_in_seconds,
+        'validation_accuracy': 0.0
+    }
+
+
+class EvaluationSummary:
+    """Keeps the number of evaluations for each status and the time spent on
+    the failed ones. Results without a status are successful."""
+
+    def __init__(self):
+        self.num_evaluations = 0
+        self.status_to_num_evaluations = {}
+        self.failed_time_in_seconds = 0.0
+
+    def update(self, results):
+        status = results.get('status', STATUS_OK)
+        self.num_evaluations += 1
+        self.status_to_num_evaluations[status] = (
+            self.status_to_num_evaluations.get(status, 0) + 1)
+        if status != STATUS_OK:
+            self.failed_time_in_seconds += results['elapsed_time_in_seconds']
+
+    def get_summary(self):
+        num_failed = self.num_evaluations - self.status_to_num_evaluations.get(
+            STATUS_OK, 0)
+        return {
+            'num_evaluations':
+            self.num_evaluations,
+            'status_to_num_evaluations':
+            dict(self.status_to_num_evaluations),
+            'failure_rate':
+            float(num_failed) / self.num_evaluations
+            if self.num_evaluations > 0 else 0.0,
+            'failed_time_in_hours':
+            self.failed_time_in_seconds / 3600.0
+        }
@@ -0,0 +1,249 @@
+import os
+import time
+import multiprocessing
+import traceback
+import logging
+from collections import deque
+
+from six.moves import queue
+
+from evaluators.limits import (STATUS_ERROR, STATUS_CRASHED,
+                               get_exceeded_limit, get_failure_results)
+
+logger = logging.getLogger(__name__)
+
+
+def _run_worker(worker_id, search_space_factory_fn, evaluator_kwargs,
+                num_threads, task_queue, result_queue):
+    import tensorflow as tf
+    from evaluators.tpu_estimator_classification import AdvanceClassifierEvaluator
+    from evaluators.fidelity import get_fidelity, build_architecture
+    from evaluators.scratch import LocalScratchStorage
+    from searchers.common import specify
+
+    session_config = tf.ConfigProto(
+        intra_op_parallelism_threads=num_threads,
+        inter_op_parallelism_threads=min(2, num_threads))
+    ssf = search_space_factory_fn()
+    evaluator = AdvanceClassifierEvaluator(session_config=session_config,
+                                           **evaluator_kwargs)
+    logger.info('Worker %d ready with %d threads', worker_id, num_threads)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, vs, state, num_training_epochs, fidelity = task
+        try:
+            channel_multiplier = get_fidelity(fidelity)['channel_multiplier']
+            if channel_multiplier != 1.0:
+                inputs, outputs = build_architecture(search_space_factory_fn,
+                                                     vs, channel_multiplier)
+            else:
+                inputs, outputs = ssf.get_search_space()
+                specify(outputs.values(), vs)
+            results = evaluator.eval(
+                inputs,
+                outputs,
+                save_fn=state.update if state is not None else None,
+                state=state,
+                num_training_epochs=num_training_epochs,
+                fidelity=fidelity)
+            result_queue.put((worker_id, task_id, results, state, None))
+        except Exception:
+            result_queue.put(
+                (worker_id, task_id, None, state, traceback.format_exc()))
+    # the deletions of the evaluator are done by a daemon thread.
+    if isinstance(evaluator.scratch_storage, LocalScratchStorage):
+        evaluator.scratch_storage.wait_for_deletions()
+
+
+class LocalEvaluatorPool:
+    """Evaluates architectures in parallel in local worker processes.
+
+    Each worker imports tensorflow and creates its search space factory and
+    :class:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator`
+    once, at startup. Its tensorflow thread pools are restricted to its share
+    of the cores. Architectures are sent to the workers as the list of
+    hyperparameter values that specifies them in the search space, and the
+    workers rebuild them.
+
+    While waiting for results, workers whose evaluation has been running for
+    longer than ``max_evaluation_time_in_seconds`` plus
+    ``kill_grace_period_in_seconds``, or whose resident memory goes over
+    ``max_rss_in_bytes``, are killed and replaced, as are workers that die.
+    The grace period lets evaluators that are given the same limits stop by
+    themselves (and covers the startup of replaced workers). These
+    evaluations, and the ones that raise an error in the worker, return the
+    results of :func:`evaluators.limits.get_failure_results`.
+
+    Workers are started with the ``spawn`` start method, so the pool needs
+    Python 3.4 or later.
+
+    Args:
+        num_workers (int): Number of worker processes.
+        search_space_factory_fn (() -> deep_architect.modules.SearchSpaceFactory):
+            Picklable function (e.g., the search space factory class) that
+            creates the search space factory in the workers.
+        evaluator_kwargs (dict[str, object]): Arguments for the evaluator.
+        num_threads_per_worker (int): Number of threads of each worker. By
+            default, the cores are split evenly across the workers.
+        max_evaluation_time_in_seconds (float): Time limit of the
+            evaluations. Not enforced if None.
+        max_rss_in_bytes (int): Limit on the resident memory of the workers.
+            Not enforced if None.
+        kill_grace_period_in_seconds (float): Time after the time limit
+            before a worker is killed.
+        poll_interval_in_seconds (float): Time between checks of the limits
+            while waiting for results.
+    """
+
+    def __init__(self,
+                 num_workers,
+                 search_space_factory_fn,
+                 evaluator_kwargs,
+                 num_threads_per_worker=None,
+                 max_evaluation_time_in_seconds=None,
+                 max_rss_in_bytes=None,
+                 kill_grace_period_in_seconds=60.0,
+                 poll_interval_in_seconds=1.0):
+        if num_threads_per_worker is None:
+            num_threads_per_worker = max(
+                1,
+                multiprocessing.cpu_count() // num_workers)
+        self.num_workers = num_workers
+        self.search_space_factory_fn = search_space_factory_fn
+        self.evaluator_kwargs = evaluator_kwargs
+        self.num_threads_per_worker = num_threads_per_worker
+        self.max_evaluation_time_in_seconds = max_evaluation_time_in_seconds
+        self.max_rss_in_bytes = max_rss_in_bytes
+        self.kill_grace_period_in_seconds = kill_grace_period_in_seconds
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        # workers are started from a fresh interpreter, as forking a process
+        # that has already imported tensorflow is not safe.
+        if not hasattr(multiprocessing, 'get_context'):
+            raise RuntimeError(
+                'The evaluator pool needs the spawn start method of '
+                'multiprocessing, available from Python 3.4')
+        self.ctx = multiprocessing.get_context('spawn')
+        self.result_queue = self.ctx.Queue()
+        # each worker has its own task queue, so that the pool knows which
+        # evaluation each worker is running.
+        self.workers = [None] * num_workers
+        self.task_queues = [None] * num_workers
+        self.worker_id_to_task = {}
+        self.pending_tasks = deque()
+        for worker_id in range(num_workers):
+            self._start_worker(worker_id)
+        self.next_task_id = 0
+
+    def _start_worker(self, worker_id):
+        task_queue = self.ctx.Queue()
+        p = self.ctx.Process(target=_run_worker,
+                             args=(worker_id, self.search_space_factory_fn,
+                                   self.evaluator_kwargs,
+                                   self.num_threads_per_worker, task_queue,
+                                   self.result_queue))
+        p.daemon = True
+        # the worker imports tensorflow while unpickling its arguments, when
+        # it imports the main module, so the thread count is set in the
+        # environment that it inherits.
+        prev_num_threads = os.environ.get('OMP_NUM_THREADS')
+        os.environ['OMP_NUM_THREADS'] = str(self.num_threads_per_worker)
+        try:
+            p.start()
+        finally:
+            if prev_num_threads is None:
+                del os.environ['OMP_NUM_THREADS']
+            else:
+                os.environ['OMP_NUM_THREADS'] = prev_num_threads
+        self.workers[worker_id] = p
+        self.task_queues[worker_id] = task_queue
+
+    def _dispatch(self):
+        for worker_id in range(self.num_workers):
+            if len(self.pending_tasks) == 0:
+                break
+            if worker_id not in self.worker_id_to_task:
+                task = self.pending_tasks.popleft()
+                self.task_queues[worker_id].put(task)
+                self.worker_id_to_task[worker_id] = (task, time.time())
+
+    def submit(self, vs, state=None, num_training_epochs=None, fidelity=None):
+        """Queues the evaluation of the architecture specified by ``vs``,
+        optionally at a reduced fidelity (see :mod:`evaluators.fidelity`).
+
+        Returns:
+            int: Id of the task, returned with its results.
+        """
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        self.pending_tasks.append(
+            (task_id, vs, state, num_training_epochs, fidelity))
+        self._dispatch()
+        return task_id
+
+    def _check_workers(self):
+        """Kills and replaces the first worker found over its limits or dead,
+        and returns the failed evaluation (or None if there is none)."""
+        for worker_id, (task, start_time) in list(
+                self.worker_id_to_task.items()):
+            p = self.workers[worker_id]
+            if not p.is_alive():
+                failure = (STATUS_CRASHED,
+                           'Worker exited with code %s' % p.exitcode)
+            else:
+                deadline = (start_time + self.max_evaluation_time_in_seconds +
+                            self.kill_grace_period_in_seconds
+                            if self.max_evaluation_time_in_seconds is not None
+                            else None)
+                failure = get_exceeded_limit(deadline, self.max_rss_in_bytes,
+                                             p.pid)
+            if failure is not None:
+                status, cause = failure
+                logger.warning('Killing worker %d running evaluation %d: %s',
+                               worker_id, task[0], cause)
+                p.terminate()
+                p.join()
+                del self.worker_id_to_task[worker_id]
+                self._start_worker(worker_id)
+                self._dispatch()
+                return task[0], get_failure_results(
+                    status, cause, time.time() - start_time), task[2]
+        return None
+
+    def get_result(self):
+        """Waits for the next evaluation to finish or fail.
+
+        Returns:
+            (int, dict[str, object], dict[str, object]): Id of the task, the
+                results of the evaluation, and the evaluation state after
+                the evaluation.
+        """
+        while True:
+            failed_evaluation = self._check_workers()
+            if failed_evaluation is not None:
+                return failed_evaluation
+            try:
+                worker_id, task_id, results, state, error = self.result_queue.get(
+                    timeout=self.poll_interval_in_seconds)
+            except queue.Empty:
+                continue
+            # results of killed workers are discarded.
+            if (worker_id not in self.worker_id_to_task or
+                    self.worker_id_to_task[worker_id][0][0] != task_id):
+                continue
+            _, start_time = self.worker_id_to_task.pop(worker_id)
+            self._dispatch()
+            if error is not None:
+                logger.warning('Evaluation %d failed in worker %d:\n%s',
+                               task_id, worker_id, error)
+                results = get_failure_results(STATUS_ERROR, error,
+                                              time.time() - start_time)
+            return task_id, results, state
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for p in self.workers:
+            p.join()
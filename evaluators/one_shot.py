@@ -0,0 +1,307 @@
+import os
+import time
+import itertools
+import logging
+import traceback
+
+import numpy as np
+import tensorflow as tf
+
+from datasets.cifar10_tf import Cifar10DataSet
+import deep_architect.core as co
+import deep_architect.utils as ut
+from search_spaces.nasbench import NODE_OPS, sample_valid_connections
+from evaluators.tpu_estimator_classification import input_fn
+from evaluators.limits import STATUS_OK, STATUS_ERROR, get_failure_results
+
+logger = logging.getLogger(__name__)
+
+
+def get_nasbench_cell_spec(outputs):
+    """Returns the structure of the cells of an architecture of the nasbench
+    search space (see :mod:`search_spaces.nasbench`), which all cells share.
+
+    The structure is read from the hyperparameters that the output module of
+    each cell and the first module of each node keep.
+
+    Returns:
+        dict[str, object]: Dictionary mapping ``in_i_j`` to whether vertex
+            ``i`` is connected to vertex ``j`` and ``node_i`` to the operation
+            of the ``i``-th intermediate node. Nodes that are not used in the
+            cell have no operation.
+    """
+    cell_spec = {}
+
+    def fn(m):
+        for name, h in m.hyperps.items():
+            if name.startswith('in_') or name.startswith('node_'):
+                cell_spec[name] = h.get_value()
+        return False
+
+    co.traverse_backward(list(outputs.values()), fn)
+    if 'in_0_1' not in cell_spec:
+        raise ValueError(
+            'The architecture is not from the nasbench search space.')
+    return cell_spec
+
+
+def conv_bn_relu(x, filters, kernel_size, name):
+    with tf.variable_scope(name):
+        x = tf.layers.conv2d(x, filters, kernel_size, padding='same')
+        # batch statistics are used both in training and evaluation, as the
+        # statistics of the shared weights change with the path.
+        x = tf.layers.batch_normalization(x,
+                                          momentum=.9,
+                                          epsilon=1e-5,
+                                          training=True)
+        return tf.nn.relu(x)
+
+
+class OneShotNasbenchEvaluator:
+    """Evaluates architectures of the nasbench search space with the shared
+    weights of a supernet.
+
+    The supernet has the cells of all the architectures of the search space,
+    with one set of weights for each operation of each node of each cell,
+    and for the projections of the inputs of the cells. The structure of
+    the cells is fed to the supernet: the inputs of the nodes are masked
+    with the connections, and the outputs of the nodes with their
+    operations. The supernet is trained once, on the first evaluation, for
+    ``num_training_epochs`` epochs, sampling a valid cell structure for every
+    minibatch. Evaluating an architecture then only computes its accuracy on
+    ``num_eval_batches`` fixed minibatches of the validation set with the
+    structure of its cells.
+
+    Nodes in the supernet always have the number of filters of the cell, and
+    the output of a cell is the sum of the nodes connected to it rather than
+    their concatenation, so that the weights can be shared by all the
+    architectures.
+
+    The results have the same format as the results of
+    :class:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator`,
+    with ``test_accuracy`` and ``num_parameters`` set to ``None``, as the
+    architecture is neither trained nor built on its own. Evaluations that
+    raise an error return the results of
+    :func:`evaluators.limits.get_failure_results`.
+
+    Args:
+        data_dir (str): Folder with the CIFAR-10 TFRecords.
+        num_training_epochs (int): Number of epochs to train the supernet.
+        batch_size (int): Size of the minibatches.
+        init_lr (float): Learning rate of Adam.
+        num_eval_batches (int): Number of validation minibatches on which
+            architectures are evaluated.
+        num_stacks (int): Number of stacks of cells, with the number of
+            filters doubled and the resolution halved in each new stack.
+        num_cells_per_stack (int): Number of cells in each stack.
+        num_nodes (int): Number of intermediate nodes in each cell.
+        num_init_filters (int): Number of filters in the first stack.
+        session_config (tf.ConfigProto): Configuration of the session.
+    """
+
+    def __init__(self,
+                 data_dir,
+                 num_training_epochs=10,
+                 batch_size=256,
+                 init_lr=.001,
+                 num_eval_batches=10,
+                 num_stacks=3,
+                 num_cells_per_stack=3,
+                 num_nodes=5,
+                 num_init_filters=128,
+                 session_config=None):
+        self.data_dir = data_dir
+        self.num_training_epochs = num_training_epochs
+        self.batch_size = batch_size
+        self.init_lr = init_lr
+        self.num_eval_batches = num_eval_batches
+        self.num_stacks = num_stacks
+        self.num_cells_per_stack = num_cells_per_stack
+        self.num_nodes = num_nodes
+        self.num_init_filters = num_init_filters
+        self.session_config = session_config
+        self.connections = list(
+            itertools.combinations(range(num_nodes + 2), 2))
+        self.is_trained = False
+        self.sess = None
+        self.eval_batches = None
+
+    def _build_cell(self, x, filters):
+        conn = lambda in_id, out_id: self.h_connections[self.connections.index(
+            (in_id, out_id))]
+        nodes = [x]
+        for out_id in range(1, self.num_nodes + 1):
+            with tf.variable_scope('node_%d' % (out_id - 1)):
+                node_in = conn(0, out_id) * conv_bn_relu(
+                    x, filters, 1, 'input_projection')
+                for in_id in range(1, out_id):
+                    node_in += conn(in_id, out_id) * nodes[in_id]
+                op_mask = tf.one_hot(self.h_ops[out_id - 1], len(NODE_OPS))
+                op_outs = []
+                for op_id, op_name in enumerate(NODE_OPS):
+                    with tf.variable_scope(op_name):
+                        if op_name == 'max3':
+                            out = tf.layers.max_pooling2d(node_in,
+                                                          3,
+                                                          1,
+                                                          padding='same')
+                            out = tf.nn.relu(
+                                tf.layers.batch_normalization(out,
+                                                              momentum=.9,
+                                                              epsilon=1e-5,
+                                                              training=True))
+                        else:
+                            out = conv_bn_relu(node_in, filters,
+                                               int(op_name[-1]), 'conv')
+                    op_outs.append(op_mask[op_id] * out)
+                nodes.append(tf.add_n(op_outs))
+        out = conn(0, self.num_nodes + 1) * conv_bn_relu(
+            x, filters, 1, 'output_projection')
+        for in_id in range(1, self.num_nodes + 1):
+            out += conn(in_id, self.num_nodes + 1) * nodes[in_id]
+        return out
+
+    def _build(self):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            train_images, train_labels = input_fn(
+                'train', self.data_dir, batch_size=self.batch_size,
+                train=True).make_one_shot_iterator().get_next()
+            self.val_batch = input_fn(
+                'validation',
+                self.data_dir,
+                batch_size=self.batch_size,
+                train=False).make_one_shot_iterator().get_next()
+            # the training minibatches are used unless others are fed.
+            self.images = tf.placeholder_with_default(train_images,
+                                                      [None, 32, 32, 3])
+            self.labels = tf.placeholder_with_default(train_labels, [None])
+            self.h_connections = tf.placeholder(tf.float32,
+                                                [len(self.connections)])
+            self.h_ops = tf.placeholder(tf.int32, [self.num_nodes])
+
+            x = conv_bn_relu(self.images, self.num_init_filters, 3, 'stem')
+            filters = self.num_init_filters
+            for i in range(self.num_stacks):
+                if i > 0:
+                    x = tf.layers.max_pooling2d(x, 2, 2, padding='same')
+                    filters *= 2
+                for j in range(self.num_cells_per_stack):
+                    with tf.variable_scope('stack_%d/cell_%d' % (i, j)):
+                        x = self._build_cell(x, filters)
+            logits = tf.layers.dense(tf.reduce_mean(x, [1, 2]), 10)
+
+            loss = tf.losses.sparse_softmax_cross_entropy(labels=self.labels,
+                                                          logits=logits)
+            self.accuracy = tf.reduce_mean(
+                tf.cast(
+                    tf.equal(tf.argmax(logits, 1, output_type=tf.int32),
+                             self.labels), tf.float32))
+            # the moving averages of batch normalization are not used, so
+            # its update ops are not run.
+            self.train_op = tf.train.AdamOptimizer(self.init_lr).minimize(
+                loss, global_step=tf.train.get_or_create_global_step())
+            self.saver = tf.train.Saver()
+            self.sess = tf.Session(config=self.session_config)
+            self.sess.run(tf.global_variables_initializer())
+
+    def _get_feed_dict(self, cell_spec):
+        return {
+            self.h_connections: [
+                cell_spec['in_%d_%d' % connection]
+                for connection in self.connections
+            ],
+            # the operation of nodes that are not used does not matter.
+            self.h_ops: [
+                NODE_OPS.index(cell_spec.get('node_%d' % i, NODE_OPS[0]))
+                for i in range(self.num_nodes)
+            ]
+        }
+
+    def train(self):
+        """Trains the supernet, sampling a valid cell structure uniformly for
+        every minibatch."""
+        if self.sess is None:
+            self._build()
+        num_steps = self.num_training_epochs * (
+            Cifar10DataSet.num_examples_per_epoch() // self.batch_size)
+        for step in range(num_steps):
+            cell_spec = {
+                'in_' + name: v for name, v in sample_valid_connections(
+                    self.num_nodes).items()
+            }
+            cell_spec.update({
+                'node_%d' % i: NODE_OPS[np.random.randint(len(NODE_OPS))]
+                for i in range(self.num_nodes)
+            })
+            self.sess.run(self.train_op,
+                          feed_dict=self._get_feed_dict(cell_spec))
+            if (step + 1) % 100 == 0:
+                logger.info('Trained the supernet for %d of %d steps',
+                            step + 1, num_steps)
+        self.is_trained = True
+
+    def eval(self,
+             inputs,
+             outputs,
+             save_fn=None,
+             state=None,
+             num_training_epochs=None,
+             fidelity=None):
+        """Computes the accuracy of the architecture with the shared weights.
+
+        The other arguments are the same as for
+        :meth:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator.eval`,
+        and are ignored.
+        """
+        start_time = time.time()
+        try:
+            return self._eval(outputs)
+        except Exception:
+            logger.exception('Evaluating the architecture failed')
+            return get_failure_results(STATUS_ERROR, traceback.format_exc(),
+                                       time.time() - start_time)
+
+    def _eval(self, outputs):
+        if not self.is_trained:
+            self.train()
+        if self.eval_batches is None:
+            self.eval_batches = [
+                self.sess.run(self.val_batch)
+                for _ in range(self.num_eval_batches)
+            ]
+        timer_manager = ut.TimerManager()
+        timer_manager.create_timer('eval')
+
+        feed_dict = self._get_feed_dict(get_nasbench_cell_spec(outputs))
+        accuracies = []
+        for images, labels in self.eval_batches:
+            feed_dict[self.images] = images
+            feed_dict[self.labels] = labels
+            accuracies.append(self.sess.run(self.accuracy,
+                                            feed_dict=feed_dict))
+        return {
+            'status':
+            STATUS_OK,
+            'validation_accuracy':
+            float(np.mean(accuracies)),
+            'test_accuracy':
+            None,
+            'num_parameters':
+            None,
+            'evaluation_time_in_seconds':
+            timer_manager.get_time_since_event('eval',
+                                               'start',
+                                               units='seconds')
+        }
+
+    def save_state(self, folder):
+        if self.is_trained:
+            self.saver.save(self.sess, os.path.join(folder, 'supernet'))
+
+    def load_state(self, folder):
+        if os.path.exists(os.path.join(folder, 'supernet.index')):
+            if self.sess is None:
+                self._build()
+            self.saver.restore(self.sess, os.path.join(folder, 'supernet'))
+            self.is_trained = True
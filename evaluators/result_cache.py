@@ -0,0 +1,70 @@
+import json
+import hashlib
+import sqlite3
+
+from surrogates.common import extract_features, get_features_fingerprint
+
+
+def get_architecture_fingerprint(inputs, outputs):
+    """Canonical fingerprint of a fully specified architecture.
+
+    Architectures built from the same search space with the same
+    hyperparameter values get the same fingerprint, also in different
+    processes.
+    """
+    return get_features_fingerprint(extract_features(inputs, outputs))
+
+
+def get_config_fingerprint(config):
+    """Fingerprint of a JSON serializable evaluator configuration."""
+    return hashlib.md5(
+        json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Results of evaluations in an SQLite database, keyed by the fingerprint
+    of the architecture and the fingerprint of the evaluator configuration.
+
+    The database uses write-ahead logging and waits on locks, so several
+    processes can read and write it concurrently. It should be kept on a
+    local filesystem, as SQLite locking is not reliable on network
+    filesystems.
+
+    Args:
+        filepath (str): Path of the database file.
+        timeout (float): Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(self, filepath, timeout=60.0):
+        self.filepath = filepath
+        self.timeout = timeout
+        self.conn = None
+
+    def get(self, arch_fingerprint, config_fingerprint):
+        """Returns the cached results, or ``None`` if there are none."""
+        row = self._get_connection().execute(
+            'SELECT results FROM results WHERE arch = ? AND config = ?',
+            (arch_fingerprint, config_fingerprint)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, arch_fingerprint, config_fingerprint, results):
+        """Stores the results. Numpy scalars are stored as Python numbers."""
+        conn = self._get_connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (arch, config, results) '
+                'VALUES (?, ?, ?)',
+                (arch_fingerprint, config_fingerprint,
+                 json.dumps(results, default=lambda x: x.item())))
+
+    def _get_connection(self):
+        # the connection is only created when used, so that the cache can be
+        # passed to other processes before that.
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.filepath, timeout=self.timeout)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            with self.conn:
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS results (arch TEXT, '
+                    'config TEXT, results TEXT, PRIMARY KEY (arch, config))')
+        return self.conn
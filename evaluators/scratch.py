@@ -0,0 +1,136 @@
+import os
+import sys
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import logging
+
+from six.moves import queue
+
+logger = logging.getLogger(__name__)
+
+
+def get_empty_bucket_folder(folder):
+    folder_name = ''
+    while True:
+        num = random.randint(0, sys.maxsize)
+        folder_name = os.path.join(folder, 'eval' + str(num))
+        try:
+            subprocess.check_call(['gsutil', '-q', 'stat', folder_name + '/**'])
+        except subprocess.CalledProcessError:
+            break
+    return folder_name
+
+
+def delete_bucket_folder(folder):
+    try:
+        subprocess.check_call(['gsutil', '-m', 'rm', folder + '/**'])
+    except:
+        pass
+
+
+class ScratchStorage:
+    """Abstract class for the storage of the model folders of evaluations.
+    """
+
+    def get_empty_folder(self):
+        """Returns a new empty folder for an evaluation."""
+        raise NotImplementedError
+
+    def delete_folder(self, folder):
+        """Deletes a folder returned by :meth:`get_empty_folder`."""
+        raise NotImplementedError
+
+
+class GCSScratchStorage(ScratchStorage):
+    """Model folders in a Google Cloud Storage bucket, managed through
+    ``gsutil``. Needed for TPU training, which reads and writes checkpoints
+    from Google Cloud Storage.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def get_empty_folder(self):
+        return get_empty_bucket_folder(self.base_dir)
+
+    def delete_folder(self, folder):
+        delete_bucket_folder(folder)
+
+
+class LocalScratchStorage(ScratchStorage):
+    """Model folders in the local filesystem.
+
+    Folders are created atomically with :func:`tempfile.mkdtemp`, so
+    concurrent evaluations never get the same folder. Deletions are done by a
+    background thread, so they do not block the evaluation loop. If a quota is
+    given, allocating a folder while the base folder uses more than the quota
+    first waits for the pending deletions, and then raises an error if the
+    quota is still exceeded.
+
+    Args:
+        base_dir (str): Folder in which the model folders are created.
+        max_num_bytes (int): Disk quota for the base folder. No quota if
+            ``None``.
+    """
+
+    def __init__(self, base_dir, max_num_bytes=None):
+        self.base_dir = base_dir
+        self.max_num_bytes = max_num_bytes
+        if not os.path.isdir(base_dir):
+            os.makedirs(base_dir)
+        self.deletion_queue = queue.Queue()
+        self.deletion_thread = threading.Thread(target=self._run_deletions)
+        self.deletion_thread.daemon = True
+        self.deletion_thread.start()
+
+    def get_empty_folder(self):
+        if self.max_num_bytes is not None:
+            if self.get_num_bytes_used() > self.max_num_bytes:
+                self.wait_for_deletions()
+            num_bytes_used = self.get_num_bytes_used()
+            if num_bytes_used > self.max_num_bytes:
+                raise RuntimeError(
+                    'Scratch folder %s uses %d bytes, over the quota of %d bytes'
+                    % (self.base_dir, num_bytes_used, self.max_num_bytes))
+        return tempfile.mkdtemp(prefix='eval', dir=self.base_dir)
+
+    def delete_folder(self, folder):
+        self.deletion_queue.put(folder)
+
+    def wait_for_deletions(self):
+        """Blocks until all the requested deletions are done."""
+        self.deletion_queue.join()
+
+    def get_num_bytes_used(self):
+        num_bytes = 0
+        for dirpath, _, filenames in os.walk(self.base_dir):
+            for filename in filenames:
+                try:
+                    num_bytes += os.path.getsize(os.path.join(
+                        dirpath, filename))
+                except OSError:
+                    # files may be deleted while walking.
+                    pass
+        return num_bytes
+
+    def _run_deletions(self):
+        while True:
+            folder = self.deletion_queue.get()
+            try:
+                shutil.rmtree(folder, ignore_errors=True)
+            except Exception:
+                logger.exception('Failed to delete scratch folder %s', folder)
+            finally:
+                self.deletion_queue.task_done()
+
+
+def get_scratch_storage(base_dir, max_num_bytes=None):
+    """Returns the storage for Google Cloud Storage paths (``gs://``) or for
+    local paths, depending on ``base_dir``."""
+    if base_dir.startswith('gs://'):
+        return GCSScratchStorage(base_dir)
+    else:
+        return LocalScratchStorage(base_dir, max_num_bytes)
@@ -1,10 +1,11 @@
 from __future__ import print_function
 
 import os
-import sys
 import gc
+import json
+import time
 import subprocess
-import random
+import traceback
 import logging
 
 import tensorflow as tf
@@ -14,6 +15,14 @@ from datasets.cifar10_tf import Cifar10DataSet
 import deep_architect.core as co
 import deep_architect.utils as ut
 import deep_architect.helpers.tfeager as htfe
+from evaluators.learning_curve import TopKTracker, MedianStoppingRule
+from evaluators.scratch import get_scratch_storage
+from evaluators.fidelity import get_fidelity, is_full_fidelity
+from evaluators.result_cache import (ResultCache, get_architecture_fingerprint,
+                                     get_config_fingerprint)
+from evaluators.limits import (STATUS_OK, STATUS_ERROR, EvaluationLimitExceeded,
+                               get_exceeded_limit, get_failure_results)
+import evaluators.weight_inheritance as wi
 
 logger = logging.getLogger(__name__)
 
@@ -27,29 +36,42 @@ def setRecompile(output_lst, recompile):
     logger.debug('set_recompile')
 
 
-def input_fn(mode, data_dir, batch_size=128, train=True):
-    data = Cifar10DataSet(data_dir, subset=mode,
-                          use_distortion=train).make_batch(batch_size)
+def input_fn(mode,
+             data_dir,
+             batch_size=128,
+             train=True,
+             num_examples=None,
+             image_size=32):
+    data = Cifar10DataSet(data_dir,
+                          subset=mode,
+                          use_distortion=train,
+                          num_examples=num_examples,
+                          image_size=image_size).make_batch(batch_size)
     return data
 
 
-def get_empty_bucket_folder(folder):
-    folder_name = ''
-    while True:
-        num = random.randint(0, sys.maxsize)
-        folder_name = os.path.join(folder, 'eval' + str(num))
-        try:
-            subprocess.check_call(['gsutil', '-q', 'stat', folder_name + '/**'])
-        except subprocess.CalledProcessError:
-            break
-    return folder_name
-
-
-def delete_bucket_folder(folder):
-    try:
-        subprocess.check_call(['gsutil', '-m', 'rm', folder + '/**'])
-    except:
-        pass
+def validation_and_test_input_fn(data_dir, batch_size=128, image_size=32):
+    """Returns the full batches of the validation set followed by the full
+    batches of the test set, with the images in the ``images`` feature and
+    whether each example is from the test set in the ``is_test`` feature.
+
+    This allows computing the validation and the test accuracies in a single
+    evaluation, restoring the model from the checkpoint only once.
+    """
+    datasets = []
+    for is_test, mode in enumerate(['validation', 'eval']):
+        num_batches = Cifar10DataSet.num_examples_per_epoch(mode) // batch_size
+        data = input_fn(mode,
+                        data_dir,
+                        batch_size=batch_size,
+                        train=False,
+                        image_size=image_size).take(num_batches)
+        datasets.append(
+            data.map(lambda images, labels, is_test=is_test: ({
+                'images': images,
+                'is_test': tf.zeros_like(labels) + is_test
+            }, labels)))
+    return datasets[0].concatenate(datasets[1])
 
 
 def record_summaries(metric_dict, step):
@@ -76,7 +98,125 @@ def construct_host_fn(metric_dict, model_dir, prefix='', max_queue_size=10):
     return host_fn, [gs_t] + other_tensors
 
 
+class LimitsHook(tf.train.SessionRunHook):
+    """Stops training or evaluation once the deadline passes or the resident
+    memory of the process goes over the limit (see
+    :func:`evaluators.limits.get_exceeded_limit`). The limits are checked
+    after every step, and :meth:`raise_if_exceeded` raises
+    :class:`evaluators.limits.EvaluationLimitExceeded` after the estimator
+    returns."""
+
+    def __init__(self, deadline=None, max_rss_in_bytes=None):
+        self.deadline = deadline
+        self.max_rss_in_bytes = max_rss_in_bytes
+        self.exceeded_limit = None
+
+    def after_run(self, run_context, run_values):
+        self.exceeded_limit = get_exceeded_limit(self.deadline,
+                                                 self.max_rss_in_bytes)
+        if self.exceeded_limit is not None:
+            run_context.request_stop()
+
+    def raise_if_exceeded(self):
+        if self.exceeded_limit is None:
+            self.exceeded_limit = get_exceeded_limit(self.deadline,
+                                                     self.max_rss_in_bytes)
+        if self.exceeded_limit is not None:
+            raise EvaluationLimitExceeded(*self.exceeded_limit)
+
+
+class SetupTimeHook(tf.train.SessionRunHook):
+    """Measures the time that calls to an estimator spend before their first
+    step, building the graph, compiling the modules, and restoring the
+    checkpoint. :meth:`start` is called right before each call."""
+
+    def __init__(self):
+        self.setup_time_in_seconds = 0.0
+        self.num_calls = 0
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.num_calls += 1
+
+    def before_run(self, run_context):
+        if self.start_time is not None:
+            self.setup_time_in_seconds += time.time() - self.start_time
+            self.start_time = None
+
+
 class AdvanceClassifierEvaluator:
+    """Trains and evaluates architectures on CIFAR-10 with a TPUEstimator.
+
+    If a learning curve predictor is given (see
+    :class:`evaluators.learning_curve.LearningCurvePredictor`), training is
+    done in chunks of ``curve_eval_interval_epochs`` epochs. After each
+    chunk, the accuracy on a ``curve_eval_fraction`` of the validation set is
+    added to the learning curve. Training stops early when the upper end of
+    the confidence interval for the final accuracy falls below the
+    ``early_stopping_top_k``-th best final validation accuracy seen so far
+    for the same budget. With ``median_stopping``, training is done in the
+    same chunks, and also stops when the learning curve falls below the
+    median of the learning curves of the previous evaluations for the same
+    budget (see :class:`evaluators.learning_curve.MedianStoppingRule`).
+    Each chunk is a separate call to the estimator, which builds a new
+    graph, compiles the modules again, and restores the checkpoint, as the
+    estimator does not keep graphs or sessions across calls. The results
+    report the number of calls and the time they spent before their first
+    step (see :class:`SetupTimeHook`), which is the overhead of the chunks.
+    The results report whether and why training stopped early and the number
+    of epochs trained, and ``early_stopping_hook`` is called with the model
+    folder, the epoch, and the reason whenever a run is stopped. The best
+    final accuracies and the previous learning curves, as well as the
+    statistics of the learning curve predictor, are only kept by this
+    evaluator, so evaluators in other
+    processes (e.g., the workers of
+    :class:`evaluators.local_pool.LocalEvaluatorPool`) would each stop
+    training based on part of the history.
+
+    Model folders are managed by ``scratch_storage`` (see
+    :mod:`evaluators.scratch`), which by default keeps them in a Google Cloud
+    Storage bucket for ``gs://`` paths and on the local disk otherwise, with
+    a disk quota of ``scratch_quota_in_bytes``. Evaluations that cannot get
+    a model folder, e.g., because the quota is exceeded, return the results
+    of :func:`evaluators.limits.get_failure_results`.
+
+    If ``result_cache_filepath`` is given, results are stored in a
+    :class:`evaluators.result_cache.ResultCache` keyed by the architecture
+    and the training configuration, and evaluating the same architecture
+    again with the same configuration returns the stored results.
+
+    Evaluations that take longer than ``max_evaluation_time_in_seconds`` or
+    whose process goes over ``max_rss_in_bytes`` of resident memory are
+    stopped (see :class:`LimitsHook`). The limits are only checked between
+    training and evaluation steps, so an evaluation stuck building the graph
+    or in a single step is not stopped. Only
+    :class:`evaluators.local_pool.LocalEvaluatorPool` kills such evaluations,
+    by killing their workers. Evaluations that are stopped or raise
+    an error return the results of
+    :func:`evaluators.limits.get_failure_results`, with the status and the
+    cause of the failure, and successful ones have status ``ok``.
+
+    The variables created by each module are written to the model folder
+    (see :func:`evaluators.weight_inheritance.forward_and_get_module_variables`).
+    If the state of a new evaluation has a ``parent_model_dir``, e.g., the
+    model folder of the architecture it was mutated from, the variables of
+    the modules that match the ones of the parent (see
+    :func:`evaluators.weight_inheritance.get_inherited_variables`) are
+    initialized from the checkpoint of the parent, and the architecture is
+    only trained for a ``fine_tuning_fraction`` of the epochs. The results
+    report the parent folder, the number of modules inherited, and the
+    reduced number of epochs in the fidelity, and are not cached. Early
+    stopping only compares them with other architectures that inherited
+    weights. Architectures are trained from scratch, with a warning, if the
+    parent folder has no checkpoint, e.g., because it was deleted.
+
+    With ``delete_scratch_after_use``, the model folder is deleted after the
+    evaluation, unless less than ``max_num_training_epochs`` epochs were
+    requested, as training may then be resumed, or the state has
+    ``keep_model_dir`` set, e.g., by a searcher that deletes the folders
+    itself once no children will inherit from them.
+    """
 
     def __init__(self,
                  data_dir,
@@ -92,7 +232,21 @@ class AdvanceClassifierEvaluator:
                  weight_decay=0.0,
                  base_dir='./scratch',
                  delete_scratch_after_use=False,
-                 use_tpu=True):
+                 use_tpu=True,
+                 learning_curve_predictor=None,
+                 early_stopping_top_k=10,
+                 curve_eval_interval_epochs=1,
+                 curve_eval_fraction=.2,
+                 median_stopping=False,
+                 median_stopping_min_num_curves=5,
+                 early_stopping_hook=None,
+                 scratch_storage=None,
+                 session_config=None,
+                 result_cache_filepath=None,
+                 max_evaluation_time_in_seconds=None,
+                 max_rss_in_bytes=None,
+                 fine_tuning_fraction=.25,
+                 scratch_quota_in_bytes=None):
         self.tpu_name = tpu_name
         self.num_examples = Cifar10DataSet.num_examples_per_epoch()
         self.batch_size = batch_size
@@ -114,6 +268,30 @@ class AdvanceClassifierEvaluator:
         self.use_tpu = use_tpu
         self.delete_scratch_after_use = delete_scratch_after_use
         self.num_parameters = -1
+        self.learning_curve_predictor = learning_curve_predictor
+        self.early_stopping_top_k = early_stopping_top_k
+        self.curve_eval_interval_epochs = curve_eval_interval_epochs
+        self.curve_eval_fraction = curve_eval_fraction
+        self.steps_per_curve_eval = max(
+            1, int(self.steps_per_val_epoch * curve_eval_fraction))
+        # best final validation accuracies for each fidelity.
+        self.budget_to_top_k = {}
+        self.median_stopping = median_stopping
+        self.median_stopping_min_num_curves = median_stopping_min_num_curves
+        self.early_stopping_hook = early_stopping_hook
+        # learning curves of the previous evaluations for each fidelity.
+        self.budget_to_median_rule = {}
+        self.scratch_storage = (scratch_storage if scratch_storage is not None
+                                else get_scratch_storage(
+                                    base_dir, scratch_quota_in_bytes))
+        self.session_config = session_config
+        self.result_cache = (ResultCache(result_cache_filepath)
+                             if result_cache_filepath is not None else None)
+        self.max_evaluation_time_in_seconds = max_evaluation_time_in_seconds
+        self.max_rss_in_bytes = max_rss_in_bytes
+        self.fine_tuning_fraction = fine_tuning_fraction
+        self.module_variables = None
+        self.inherited_module_names = []
 
     def get_optimizer(self, learning_rate):
         if self.optimizer_type == 'adam':
@@ -128,8 +306,11 @@ class AdvanceClassifierEvaluator:
             raise ValueError('Optimizer type not recognized: %s' %
                              self.optimizer_type)
 
-    def get_learning_rate(self, step):
-        total_steps = int(self.max_num_training_epochs * self.num_examples /
+    def get_learning_rate(self, step, num_examples=None):
+        if num_examples is None:
+            num_examples = self.num_examples
+        steps_per_epoch = num_examples // self.batch_size
+        total_steps = int(self.max_num_training_epochs * num_examples /
                           self.batch_size)
         if self.lr_decay_method == 'constant':
             lr = self.init_lr
@@ -150,11 +331,11 @@ class AdvanceClassifierEvaluator:
         else:
             lr = tf.train.exponential_decay(self.init_lr,
                                             step,
-                                            self.steps_per_epoch *
+                                            steps_per_epoch *
                                             self.lr_num_epochs_per_decay,
                                             self.lr_decay_value,
                                             staircase=True)
-            warmup_steps = int(self.lr_warmup_epochs * self.steps_per_epoch)
+            warmup_steps = int(self.lr_warmup_epochs * steps_per_epoch)
             warmup_lr = (self.init_lr * tf.cast(step, tf.float32) /
                          tf.cast(warmup_steps, tf.float32))
             lr = tf.cond(step < warmup_steps, lambda: warmup_lr, lambda: lr)
@@ -162,40 +343,149 @@ class AdvanceClassifierEvaluator:
 
         return lr
 
-    def eval(self, inputs, outputs, save_fn=None, state=None):
+    def eval(self,
+             inputs,
+             outputs,
+             save_fn=None,
+             state=None,
+             num_training_epochs=None,
+             fidelity=None):
+        """Trains and evaluates the architecture.
+
+        ``num_training_epochs`` allows training for a smaller budget than
+        ``max_num_training_epochs``. The learning rate schedule is still the
+        one for the full budget, so calling eval again with the same state
+        and a larger budget resumes training from the checkpoint in the
+        model folder of the state.
+
+        ``fidelity`` allows cheaper evaluations on a fraction of the training
+        set, for fewer epochs (which take precedence over
+        ``num_training_epochs``), or with smaller images (see
+        :func:`evaluators.fidelity.get_fidelity`). The channel multiplier of
+        the fidelity is applied when building the architecture (see
+        :func:`evaluators.fidelity.build_architecture`). The results include
+        the fidelity, and early stopping only compares evaluations with the
+        same fidelity.
+        """
+        start_time = time.time()
         tf.reset_default_graph()
+        # the graph is built again for every call to the estimator, but the
+        # memory of the previous architecture is only collected once.
+        gc.collect()
         self.num_parameters = -1
+        self.module_variables = None
+        self.inherited_module_names = []
+        fidelity = get_fidelity(fidelity)
+        if fidelity['num_training_epochs'] is not None:
+            num_training_epochs = fidelity['num_training_epochs']
+        elif num_training_epochs is None:
+            num_training_epochs = self.max_num_training_epochs
+        fidelity['num_training_epochs'] = num_training_epochs
+        num_examples = int(self.num_examples * fidelity['train_fraction'])
+        steps_per_epoch = num_examples // self.batch_size
         logger.debug('In Evaluator')
+        if self.result_cache is not None:
+            arch_fingerprint = get_architecture_fingerprint(inputs, outputs)
+            config_fingerprint = get_config_fingerprint(
+                self._get_config(fidelity))
+            cached_results = self.result_cache.get(arch_fingerprint,
+                                                   config_fingerprint)
+            if cached_results is not None:
+                logger.info('Using cached results for architecture %s',
+                            arch_fingerprint)
+                # the state points to the model folder of the cached
+                # evaluation, so that training can be resumed from it.
+                cached_model_dir = cached_results.get('model_dir')
+                if (save_fn is not None and
+                        (state is None or 'model_dir' not in state) and
+                        cached_model_dir is not None and
+                        tf.train.latest_checkpoint(cached_model_dir)
+                        is not None):
+                    save_fn({
+                        'model_dir': cached_model_dir,
+                        'learning_curve': cached_results['learning_curve']
+                    })
+                return cached_results
+        parent_model_dir = parent_module_variables = None
         if state is not None and 'model_dir' in state:
             model_dir = state['model_dir']
         else:
-            model_dir = get_empty_bucket_folder(self.base_dir)
+            # e.g., the scratch quota is exceeded.
+            try:
+                model_dir = self.scratch_storage.get_empty_folder()
+            except Exception:
+                logger.exception('Failed to get a folder for the evaluation')
+                return get_failure_results(STATUS_ERROR,
+                                           traceback.format_exc(),
+                                           time.time() - start_time)
             if save_fn is not None:
                 save_fn({'model_dir': model_dir})
+            if state is not None and state.get('parent_model_dir') is not None:
+                parent_module_variables = self._read_module_variables(
+                    state['parent_model_dir'])
+                if parent_module_variables is not None:
+                    parent_model_dir = state['parent_model_dir']
+                    num_training_epochs = max(
+                        1,
+                        int(round(num_training_epochs *
+                                  self.fine_tuning_fraction)))
+                else:
+                    logger.warning(
+                        'No checkpoint to inherit weights from in %s, '
+                        'training from scratch for %d epochs',
+                        state['parent_model_dir'], num_training_epochs)
+        # the folder is kept if training may be resumed later with a larger
+        # budget, i.e., if less than the full budget was requested, or if the
+        # searcher keeps it, e.g., for children to inherit its weights.
+        keep_model_dir = (
+            fidelity['num_training_epochs'] < self.max_num_training_epochs or
+            (state is not None and state.get('keep_model_dir', False)))
+        # runs that inherit weights are recorded with their reduced budget,
+        # and only compared with each other for early stopping.
+        fidelity['num_training_epochs'] = num_training_epochs
+        inherited = parent_model_dir is not None
         logger.info('Using folder %s for evaluation', model_dir)
-
-        def metric_fn(labels, predictions):
-            return {'accuracy': tf.metrics.accuracy(labels, predictions)}
+        if parent_model_dir is not None:
+            logger.info('Inheriting weights from %s and training for %d epochs',
+                        parent_model_dir, num_training_epochs)
+
+        def metric_fn(labels, predictions, is_test=None):
+            if is_test is None:
+                return {'accuracy': tf.metrics.accuracy(labels, predictions)}
+            is_test = tf.cast(is_test, tf.float32)
+            return {
+                'accuracy':
+                tf.metrics.accuracy(labels, predictions, weights=1.0 - is_test),
+                'test_accuracy':
+                tf.metrics.accuracy(labels, predictions, weights=is_test)
+            }
 
         def model_fn(features, labels, mode, params):
+            # the estimator creates a new graph for each call, so the modules
+            # are compiled again to create their variables in it.
             setRecompile(outputs.values(), True)
-            gc.collect()
+            is_test = None
+            if isinstance(features, dict):
+                is_test = features['is_test']
+                features = features['images']
             htfe.setTraining(outputs.values(),
                              mode == tf.estimator.ModeKeys.TRAIN)
             step = tf.train.get_or_create_global_step()
             if 'In' in inputs:
-                co.forward({inputs['In']: features})
+                module_variables = wi.forward_and_get_module_variables(
+                    {inputs['In']: features}, tf.global_variables)
                 logits = outputs['Out'].val
             else:
-                co.forward({
-                    inputs['In0']:
-                    features,
-                    inputs['In1']:
-                    tf.math.divide(
-                        tf.cast(step, tf.float32),
-                        float(self.steps_per_epoch *
-                              self.max_num_training_epochs))
-                })
+                module_variables = wi.forward_and_get_module_variables(
+                    {
+                        inputs['In0']:
+                        features,
+                        inputs['In1']:
+                        tf.math.divide(
+                            tf.cast(step, tf.float32),
+                            float(steps_per_epoch *
+                                  self.max_num_training_epochs))
+                    }, tf.global_variables)
                 logits = outputs['Out1'].val
                 aux_logits = outputs['Out0'].val
 
@@ -226,10 +516,11 @@ class AdvanceClassifierEvaluator:
                 reduction=tf.losses.Reduction.MEAN) if 'Out1' in outputs else 0
             loss = unreg_loss + l2_loss + aux_loss
             if mode == tf.estimator.ModeKeys.EVAL:
+                metric_tensors = [labels, predicted_classes]
+                if is_test is not None:
+                    metric_tensors.append(is_test)
                 return tf.contrib.tpu.TPUEstimatorSpec(
-                    mode,
-                    loss=loss,
-                    eval_metrics=(metric_fn, [labels, predicted_classes]))
+                    mode, loss=loss, eval_metrics=(metric_fn, metric_tensors))
 
             # Create training op.
             assert mode == tf.estimator.ModeKeys.TRAIN
@@ -238,9 +529,30 @@ class AdvanceClassifierEvaluator:
                     np.prod(v.get_shape().as_list())
                     for v in tf.trainable_variables()
                 ])
+            if self.module_variables is None:
+                self.module_variables = {
+                    name: {
+                        'type': d['type'],
+                        'variables': [(v.op.name, shape)
+                                      for v, shape in d['variables']]
+                    } for name, d in module_variables.items()
+                }
+            scaffold_fn = None
+            if parent_module_variables is not None:
+                # the initializers are only used if the model folder has no
+                # checkpoint yet, i.e., in the first call to train.
+                assignment_map, self.inherited_module_names = (
+                    wi.get_inherited_variables(parent_module_variables,
+                                               module_variables))
+
+                def scaffold_fn():
+                    tf.train.init_from_checkpoint(parent_model_dir,
+                                                  assignment_map)
+                    return tf.train.Scaffold()
+
             accuracy = metric_fn(labels, predicted_classes)['accuracy']
             tf.identity(accuracy[1], name='train_accuracy')
-            learning_rate = self.get_learning_rate(step)
+            learning_rate = self.get_learning_rate(step, num_examples)
             metric_dict = {
                 'batch_loss':
                 loss,
@@ -257,7 +569,7 @@ class AdvanceClassifierEvaluator:
                 host_fn = construct_host_fn(metric_dict,
                                             model_dir,
                                             prefix='training/',
-                                            max_queue_size=self.steps_per_epoch)
+                                            max_queue_size=steps_per_epoch)
                 optimizer = tf.contrib.tpu.CrossShardOptimizer(optimizer)
             else:
                 record_summaries(metric_dict, step)
@@ -272,7 +584,8 @@ class AdvanceClassifierEvaluator:
             return tf.contrib.tpu.TPUEstimatorSpec(mode,
                                                    loss=loss,
                                                    train_op=train_op,
-                                                   host_call=host_fn)
+                                                   host_call=host_fn,
+                                                   scaffold_fn=scaffold_fn)
 
         if self.use_tpu:
             my_project_name = subprocess.check_output(
@@ -286,12 +599,13 @@ class AdvanceClassifierEvaluator:
         run_config = tf.contrib.tpu.RunConfig(
             cluster=cluster_resolver,
             model_dir=model_dir,
+            session_config=self.session_config,
             save_checkpoints_steps=self.max_num_training_epochs *
-            self.steps_per_epoch,
+            steps_per_epoch,
             keep_checkpoint_max=1,
-            log_step_count_steps=self.steps_per_epoch,
+            log_step_count_steps=steps_per_epoch,
             tpu_config=tf.contrib.tpu.TPUConfig(
-                iterations_per_loop=self.steps_per_epoch, num_shards=8),
+                iterations_per_loop=steps_per_epoch, num_shards=8),
         )
 
         try:
@@ -306,70 +620,223 @@ class AdvanceClassifierEvaluator:
 
             timer_manager = ut.TimerManager()
             timer_manager.create_timer('eval')
-
-            train_fn = lambda params: input_fn('train',
-                                               self.data_dir,
-                                               batch_size=params['batch_size'],
-                                               train=True)
+            limits_hook = LimitsHook(
+                start_time + self.max_evaluation_time_in_seconds
+                if self.max_evaluation_time_in_seconds is not None else None,
+                self.max_rss_in_bytes)
+            setup_hook = SetupTimeHook()
+
+            train_fn = lambda params: input_fn(
+                'train',
+                self.data_dir,
+                batch_size=params['batch_size'],
+                train=True,
+                num_examples=num_examples
+                if fidelity['train_fraction'] < 1.0 else None,
+                image_size=fidelity['image_size'])
             val_fn = lambda params: input_fn('validation',
                                              self.data_dir,
                                              batch_size=params['batch_size'],
-                                             train=False)
-            try:
-                estimator.train(input_fn=train_fn,
-                                max_steps=self.steps_per_epoch *
-                                self.max_num_training_epochs)
-            except (tf.train.NanLossDuringTrainingError,
-                    tf.errors.InvalidArgumentError):
-                logger.warning(
-                    'Architecture in %s received nan loss in training',
-                    model_dir)
+                                             train=False,
+                                             image_size=fidelity['image_size'])
+            if state is not None and 'learning_curve' in state:
+                learning_curve = list(state['learning_curve'])
+            else:
+                learning_curve = []
+            stopping_reason = None
+            epochs_trained = (learning_curve[-1][0]
+                              if len(learning_curve) > 0 else 0)
+            if (self.learning_curve_predictor is None and
+                    not self.median_stopping):
+                epoch_ends = [num_training_epochs]
+            else:
+                interval = self.curve_eval_interval_epochs
+                first_epoch_end = (learning_curve[-1][0] + interval
+                                   if len(learning_curve) > 0 else interval)
+                epoch_ends = list(
+                    range(first_epoch_end, num_training_epochs,
+                          interval)) + [num_training_epochs]
+
+            for epoch_end in epoch_ends:
+                try:
+                    setup_hook.start()
+                    estimator.train(input_fn=train_fn,
+                                    max_steps=steps_per_epoch * epoch_end,
+                                    hooks=[limits_hook, setup_hook])
+                except (tf.train.NanLossDuringTrainingError,
+                        tf.errors.InvalidArgumentError):
+                    logger.warning(
+                        'Architecture in %s received nan loss in training',
+                        model_dir)
+                    break
+                limits_hook.raise_if_exceeded()
+                epochs_trained = epoch_end
+                # the last chunk is followed by the full validation below.
+                if epoch_end == num_training_epochs:
+                    break
+
+                setup_hook.start()
+                curve_results = estimator.evaluate(
+                    input_fn=val_fn,
+                    steps=self.steps_per_curve_eval,
+                    name='curve',
+                    hooks=[limits_hook, setup_hook])
+                limits_hook.raise_if_exceeded()
+                learning_curve.append(
+                    [epoch_end, float(curve_results['accuracy'])])
+                if save_fn is not None:
+                    save_fn({'learning_curve': learning_curve})
+                stopping_reason = self._get_stopping_reason(
+                    learning_curve, fidelity, inherited)
+                if stopping_reason is not None:
+                    logger.info(
+                        'Stopping architecture in %s early at epoch %d (%s)',
+                        model_dir, epoch_end, stopping_reason)
+                    if self.early_stopping_hook is not None:
+                        self.early_stopping_hook(model_dir, epoch_end,
+                                                 stopping_reason)
+                    break
 
             logger.debug("Optimization Finished!")
-
-            val_fn = lambda params: input_fn('validation',
-                                             self.data_dir,
-                                             batch_size=params['batch_size'],
-                                             train=False)
+            if self.module_variables is not None:
+                with tf.gfile.GFile(
+                        os.path.join(model_dir, wi.MODULE_VARIABLES_FILENAME),
+                        'w') as f:
+                    json.dump(self.module_variables, f)
+
+            val_and_test_fn = lambda params: validation_and_test_input_fn(
+                self.data_dir,
+                batch_size=params['batch_size'],
+                image_size=fidelity['image_size'])
+            num_eval_steps = sum(
+                Cifar10DataSet.num_examples_per_epoch(mode) // self.batch_size
+                for mode in ['validation', 'eval'])
 
             timer_manager.tick_timer('eval')
-            eval_results = estimator.evaluate(input_fn=val_fn,
-                                              steps=self.steps_per_val_epoch)
+            setup_hook.start()
+            eval_results = estimator.evaluate(
+                input_fn=val_and_test_fn,
+                steps=num_eval_steps,
+                hooks=[limits_hook, setup_hook])
+            limits_hook.raise_if_exceeded()
             t_infer = (
                 timer_manager.get_time_since_last_tick('eval', 'miliseconds') /
-                Cifar10DataSet.num_examples_per_epoch('validation'))
+                (num_eval_steps * self.batch_size))
 
             val_acc = float(eval_results['accuracy'])
             logger.debug("Validation accuracy: %f", val_acc)
 
             results = {
+                'status': STATUS_OK,
                 'validation_accuracy': val_acc,
                 'num_parameters': self.num_parameters,
                 'inference_time_per_example_in_miliseconds': t_infer,
-                'epoch': int(eval_results['global_step']) / self.steps_per_epoch
+                'epoch': int(eval_results['global_step']) / steps_per_epoch,
+                'epochs_trained': epochs_trained,
+                'stopped_early': stopping_reason is not None,
+                'stopping_reason': stopping_reason,
+                'learning_curve': learning_curve,
+                'fidelity': fidelity,
+                'full_fidelity': is_full_fidelity(fidelity),
+                'model_dir': model_dir,
+                'inherited_from': parent_model_dir,
+                'num_inherited_modules': len(self.inherited_module_names),
+                'num_estimator_calls': setup_hook.num_calls,
+                'setup_time_in_seconds': setup_hook.setup_time_in_seconds
             }
-            test_fn = lambda params: input_fn('eval',
-                                              self.data_dir,
-                                              batch_size=params['batch_size'],
-                                              train=False)
-
-            test_results = estimator.evaluate(input_fn=test_fn,
-                                              steps=self.steps_per_test_epoch,
-                                              name='test')
-            test_acc = float(test_results['accuracy'])
+            logger.info(
+                'Spent %.1f seconds setting up %d estimator calls for %s',
+                setup_hook.setup_time_in_seconds, setup_hook.num_calls,
+                model_dir)
+            if stopping_reason is None:
+                self._get_top_k_tracker(fidelity, inherited).update(val_acc)
+            self._get_median_rule(fidelity,
+                                  inherited).add_curve(learning_curve)
+            test_acc = float(eval_results['test_accuracy'])
             logger.debug("Test accuracy: %f", test_acc)
             results['test_accuracy'] = test_acc
 
             results[
                 'training_time_in_hours'] = timer_manager.get_time_since_event(
                     'eval', 'start', units='hours')
-        except:
-            pass
+            # results of fine-tuned architectures depend on their parent.
+            if self.result_cache is not None and parent_model_dir is None:
+                self.result_cache.put(arch_fingerprint, config_fingerprint,
+                                      results)
+        except EvaluationLimitExceeded as e:
+            logger.warning('Evaluation in %s stopped: %s', model_dir, e)
+            results = get_failure_results(e.status, str(e),
+                                          time.time() - start_time)
+        except Exception:
+            logger.exception('Evaluation in %s failed', model_dir)
+            results = get_failure_results(STATUS_ERROR, traceback.format_exc(),
+                                          time.time() - start_time)
         finally:
-            if self.delete_scratch_after_use:
-                delete_bucket_folder(model_dir)
+            if self.delete_scratch_after_use and not keep_model_dir:
+                self.scratch_storage.delete_folder(model_dir)
         return results
 
+    def _get_config(self, fidelity):
+        return {
+            'data_dir': self.data_dir,
+            'fidelity': fidelity,
+            'max_num_training_epochs': self.max_num_training_epochs,
+            'optimizer_type': self.optimizer_type,
+            'batch_size': self.batch_size,
+            'lr_decay_method': self.lr_decay_method,
+            'init_lr': self.init_lr,
+            'lr_decay_value': self.lr_decay_value,
+            'lr_num_epochs_per_decay': self.lr_num_epochs_per_decay,
+            'lr_warmup_epochs': self.lr_warmup_epochs,
+            'weight_decay': self.weight_decay,
+            'use_tpu': self.use_tpu,
+            'learning_curve_early_stopping':
+            self.learning_curve_predictor is not None,
+            'early_stopping_top_k': self.early_stopping_top_k,
+            'median_stopping': self.median_stopping,
+            'median_stopping_min_num_curves':
+            self.median_stopping_min_num_curves,
+            'curve_eval_interval_epochs': self.curve_eval_interval_epochs,
+            'curve_eval_fraction': self.curve_eval_fraction
+        }
+
+    def _get_top_k_tracker(self, fidelity, inherited=False):
+        key = (tuple(sorted(fidelity.items())), inherited)
+        if key not in self.budget_to_top_k:
+            self.budget_to_top_k[key] = TopKTracker(self.early_stopping_top_k)
+        return self.budget_to_top_k[key]
+
+    def _get_median_rule(self, fidelity, inherited=False):
+        key = (tuple(sorted(fidelity.items())), inherited)
+        if key not in self.budget_to_median_rule:
+            self.budget_to_median_rule[key] = MedianStoppingRule(
+                self.median_stopping_min_num_curves)
+        return self.budget_to_median_rule[key]
+
+    def _get_stopping_reason(self, learning_curve, fidelity, inherited=False):
+        if (self.median_stopping and self._get_median_rule(
+                fidelity, inherited).should_stop(learning_curve)):
+            return 'median'
+
+        threshold = self._get_top_k_tracker(fidelity,
+                                            inherited).get_threshold()
+        if self.learning_curve_predictor is None or threshold is None:
+            return None
+        epochs, accuracies = zip(*learning_curve)
+        prediction = self.learning_curve_predictor.predict(
+            epochs, accuracies, fidelity['num_training_epochs'])
+        if prediction is not None and prediction[2] < threshold:
+            return 'learning_curve'
+        return None
+
+    def _read_module_variables(self, model_dir):
+        filepath = os.path.join(model_dir, wi.MODULE_VARIABLES_FILENAME)
+        if (tf.train.latest_checkpoint(model_dir) is None or
+                not tf.gfile.Exists(filepath)):
+            return None
+        with tf.gfile.GFile(filepath) as f:
+            return json.load(f)
+
     def save_state(self, folder):
         pass
 
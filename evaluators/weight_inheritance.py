@@ -0,0 +1,87 @@
+import deep_architect.core as co
+
+MODULE_VARIABLES_FILENAME = 'module_variables.json'
+
+
+def get_module_type(m):
+    """Returns the type of the module, e.g., ``Conv2D_3x3`` for a module named
+    ``M.Conv2D_3x3-0``."""
+    return m.get_name().split('.', 1)[1].rsplit('-', 1)[0]
+
+
+def forward_and_get_module_variables(input_to_val, get_variables_fn):
+    """Same as :func:`deep_architect.core.forward`, also returning the
+    variables created by each module.
+
+    Args:
+        input_to_val (dict[deep_architect.core.Input, object]): Dictionary of
+            initial inputs to their corresponding values.
+        get_variables_fn (() -> list[object]): Returns the variables created
+            so far, in order of creation, e.g., ``tf.global_variables``.
+
+    Returns:
+        dict[str, dict[str, object]]: Dictionary mapping the name of each
+            module that created variables to its type and to the list of
+            ``(variable, shape)`` pairs of its variables, in order of
+            creation.
+    """
+    module_seq = co.determine_module_eval_seq(input_to_val.keys())
+    for ix, val in input_to_val.items():
+        ix.val = val
+
+    module_variables = {}
+    num_variables = len(get_variables_fn())
+    for m in module_seq:
+        m.forward()
+        for ox in m.outputs.values():
+            for ix in ox.get_connected_inputs():
+                ix.val = ox.val
+        variables = get_variables_fn()
+        if len(variables) > num_variables:
+            module_variables[m.get_name()] = {
+                'type':
+                get_module_type(m),
+                'variables': [(v, v.get_shape().as_list())
+                              for v in variables[num_variables:]]
+            }
+        num_variables = len(variables)
+    return module_variables
+
+
+def get_inherited_variables(parent_module_variables, module_variables):
+    """Matches the variables of an architecture with the ones of its parent.
+
+    The variables of a module are inherited if the parent has a module with
+    the same name and type, and with variables of the same shapes, created in
+    the same order.
+
+    Args:
+        parent_module_variables (dict[str, dict[str, object]]): Variables of
+            the modules of the parent, with the names of the variables in the
+            checkpoint of the parent in place of the variables (see
+            :func:`forward_and_get_module_variables`).
+        module_variables (dict[str, dict[str, object]]): Variables of the
+            modules of the architecture.
+
+    Returns:
+        (dict[str, object], list[str]):
+            Dictionary mapping the names of the variables in the checkpoint
+            of the parent to the variables that are initialized with them,
+            and the names of the modules whose variables are inherited.
+    """
+    assignment_map = {}
+    inherited_module_names = []
+    for name, d in sorted(module_variables.items()):
+        parent_d = parent_module_variables.get(name)
+        if (parent_d is None or parent_d['type'] != d['type'] or
+                len(parent_d['variables']) != len(d['variables'])):
+            continue
+        if all(
+                list(parent_shape) == list(shape)
+                for (_, parent_shape), (_, shape) in zip(
+                    parent_d['variables'], d['variables'])):
+            for (parent_v, _), (v, _) in zip(parent_d['variables'],
+                                             d['variables']):
+                assignment_map[parent_v] = v
+            inherited_module_names.append(name)
+    return assignment_map, inherited_module_names
@@ -0,0 +1,196 @@
+import time
+import logging
+import traceback
+
+import tensorflow as tf
+import numpy as np
+
+from datasets.cifar10_tf import Cifar10DataSet
+import deep_architect.core as co
+import deep_architect.utils as ut
+import deep_architect.helpers.tfeager as htfe
+from evaluators.tpu_estimator_classification import setRecompile
+from evaluators.limits import STATUS_OK, STATUS_ERROR, get_failure_results
+
+logger = logging.getLogger(__name__)
+
+PROXY_NAMES = ['grad_norm', 'snip', 'synflow', 'jacob_cov']
+
+
+def get_jacob_cov_score(jacobians, k=1e-5):
+    """Score of the correlations between the input Jacobians of the examples
+    of a minibatch. Architectures whose Jacobians are less correlated across
+    examples score higher."""
+    corrs = np.corrcoef(jacobians.reshape(jacobians.shape[0], -1))
+    corrs = np.nan_to_num(corrs)
+    vs = np.linalg.eigvalsh(corrs)
+    return float(-np.sum(np.log(vs + k) + 1. / (vs + k)))
+
+
+class ZeroCostEvaluator:
+    """Scores architectures without training them.
+
+    Each architecture is built once, in inference mode, and the proxies are
+    computed on a single minibatch of the CIFAR-10 training set (read once
+    and reused across evaluations). At initialization, batch normalization in
+    inference mode is the identity, as if it were removed:
+
+    - ``grad_norm``: sum of the norms of the gradients of the loss with
+      respect to the weights.
+    - ``snip``: sum of the absolute values of the products of the weights and
+      the gradients of the loss.
+    - ``synflow``: sum of the products of the weights and the gradients of the
+      sum of the outputs, for absolute valued weights and an input of ones
+      (fed to the same graph once the other proxies are computed).
+    - ``jacob_cov``: see :func:`get_jacob_cov_score`.
+
+    The results have the keys of the results of
+    :class:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator`
+    that do not depend on training: ``status``, ``num_parameters``, and
+    ``validation_accuracy``, which is set to the proxy chosen for ranking the
+    architectures, as this is the value that searchers are updated with.
+    ``test_accuracy`` is ``None``. Evaluations that raise an error return the
+    results of :func:`evaluators.limits.get_failure_results`.
+
+    Args:
+        data_dir (str): Folder with the CIFAR-10 TFRecords.
+        proxy_name (str): Proxy reported as ``validation_accuracy``. One of
+            :data:`PROXY_NAMES`.
+        batch_size (int): Size of the minibatch.
+        session_config (tf.ConfigProto): Configuration of the sessions. By
+            default, only the CPU is used.
+    """
+
+    def __init__(self,
+                 data_dir,
+                 proxy_name='synflow',
+                 batch_size=64,
+                 session_config=None):
+        if proxy_name not in PROXY_NAMES:
+            raise ValueError('Proxy not recognized: %s' % proxy_name)
+        self.data_dir = data_dir
+        self.proxy_name = proxy_name
+        self.batch_size = batch_size
+        self.session_config = (session_config if session_config is not None
+                               else tf.ConfigProto(device_count={'GPU': 0}))
+        self.images = None
+        self.labels = None
+
+    def _get_minibatch(self):
+        if self.images is None:
+            with tf.Graph().as_default():
+                dataset = Cifar10DataSet(self.data_dir,
+                                         subset='train',
+                                         use_distortion=False).make_batch(
+                                             self.batch_size)
+                next_batch = dataset.make_one_shot_iterator().get_next()
+                with tf.Session(config=self.session_config) as sess:
+                    self.images, self.labels = sess.run(next_batch)
+        return self.images, self.labels
+
+    def _forward(self, inputs, outputs, x):
+        if 'In' in inputs:
+            co.forward({inputs['In']: x})
+            return outputs['Out'].val
+        else:
+            co.forward({inputs['In0']: x, inputs['In1']: tf.constant(0.0)})
+            return outputs['Out1'].val
+
+    def eval(self,
+             inputs,
+             outputs,
+             save_fn=None,
+             state=None,
+             num_training_epochs=None,
+             fidelity=None):
+        """Computes the proxies for the architecture.
+
+        The other arguments are the same as for
+        :meth:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator.eval`,
+        and are ignored.
+        """
+        start_time = time.time()
+        try:
+            results = self._eval(inputs, outputs)
+        except Exception:
+            logger.exception('Scoring the architecture failed')
+            return get_failure_results(STATUS_ERROR, traceback.format_exc(),
+                                       time.time() - start_time)
+        logger.debug('Zero-cost proxies: %s', results)
+        return results
+
+    def _eval(self, inputs, outputs):
+        images, labels = self._get_minibatch()
+        timer_manager = ut.TimerManager()
+        timer_manager.create_timer('eval')
+
+        tf.reset_default_graph()
+        setRecompile(outputs.values(), True)
+        x = tf.placeholder(tf.float32, shape=(None,) + images.shape[1:])
+        y = tf.placeholder(tf.int32, shape=labels.shape)
+
+        htfe.setTraining(outputs.values(), False)
+        logits = self._forward(inputs, outputs, x)
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=y, logits=logits)
+        weights = tf.trainable_variables()
+        # weights that do not affect the loss have no gradient.
+        grads, grad_weights = zip(
+            *[(g, w)
+              for g, w in zip(tf.gradients(loss, weights), weights)
+              if g is not None])
+        sum_logits = tf.reduce_sum(logits)
+        jacobians = tf.gradients(sum_logits, x)[0]
+        synflow_grads, synflow_weights = zip(
+            *[(g, w)
+              for g, w in zip(tf.gradients(sum_logits, weights), weights)
+              if g is not None])
+        abs_ops = [tf.assign(w, tf.abs(w)) for w in weights]
+
+        with tf.Session(config=self.session_config) as sess:
+            sess.run(tf.global_variables_initializer())
+            weight_vals, grad_weight_vals, grad_vals, jacobian_vals = sess.run(
+                [weights, grad_weights, grads, jacobians],
+                feed_dict={
+                    x: images,
+                    y: labels
+                })
+            # synflow is computed for an input of ones, with the weights
+            # replaced by their absolute values.
+            sess.run(abs_ops)
+            synflow_weight_vals, synflow_grad_vals = sess.run(
+                [synflow_weights, synflow_grads],
+                feed_dict={x: np.ones((1,) + images.shape[1:])})
+
+        results = {
+            'status':
+            STATUS_OK,
+            'num_parameters':
+            int(sum(np.prod(w.shape) for w in weight_vals)),
+            'grad_norm':
+            float(sum(np.linalg.norm(g) for g in grad_vals)),
+            'snip':
+            float(
+                sum(
+                    np.sum(np.abs(g * w))
+                    for g, w in zip(grad_vals, grad_weight_vals))),
+            'synflow':
+            float(
+                sum(
+                    np.sum(g * w)
+                    for g, w in zip(synflow_grad_vals, synflow_weight_vals))),
+            'jacob_cov':
+            get_jacob_cov_score(jacobian_vals),
+        }
+        results['validation_accuracy'] = results[self.proxy_name]
+        results['test_accuracy'] = None
+        results['proxy_name'] = self.proxy_name
+        results['scoring_time_in_seconds'] = (
+            timer_manager.get_time_since_event('eval', 'start',
+                                               units='seconds'))
+        return results
+
+    def save_state(self, folder):
+        pass
+
+    def load_state(self, folder):
+        pass
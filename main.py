@@ -1,23 +1,101 @@
+import os
 import logging
 import argparse
 
-from searchers import random as rs, mcts, regularized_evolution_searcher, smbo_random
+from searchers import (random as rs, mcts, regularized_evolution_searcher,
+                       smbo_random, successive_halving, budget)
 from search_spaces import genetic_space, nasbench, nasnet_space, main_hierarchical
-from evaluators import tpu_estimator_classification
-from surrogates import hashing
+from evaluators import (tpu_estimator_classification, learning_curve,
+                        local_pool, zero_cost, limits, one_shot, scratch,
+                        fidelity as fidelity_lib)
+from surrogates import hashing, ensemble, common as surrogates_common
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(name=__name__)
 
 
-def run_search(searcher, evaluator, num_samples):
+def get_eval_kwargs(searcher_eval_token, fidelity=None):
+    """Returns the evaluator arguments that the searcher asks for through the
+    searcher evaluation token.
+
+    The evaluation state in the token is updated in place by the evaluator,
+    so that the searcher can resume the evaluation later. ``fidelity`` is
+    used for the tokens that do not ask for a fidelity.
+    """
+    eval_kwargs = {}
+    if 'evaluation_state' in searcher_eval_token:
+        state = searcher_eval_token['evaluation_state']
+        eval_kwargs['state'] = state
+        eval_kwargs['save_fn'] = state.update
+    if 'num_training_epochs' in searcher_eval_token:
+        eval_kwargs['num_training_epochs'] = searcher_eval_token[
+            'num_training_epochs']
+    if 'fidelity' in searcher_eval_token:
+        eval_kwargs['fidelity'] = searcher_eval_token['fidelity']
+    elif fidelity is not None:
+        eval_kwargs['fidelity'] = fidelity
+    return eval_kwargs
+
+
+def run_search(searcher,
+               evaluator,
+               num_samples,
+               search_space_factory_fn=None,
+               fidelity=None):
+    """Runs the search, evaluating the architectures one at a time.
+
+    Architectures are evaluated with ``fidelity`` unless the searcher asks
+    for another one. Architectures evaluated with a channel multiplier are
+    rebuilt with ``search_space_factory_fn`` (see
+    :func:`evaluators.fidelity.build_architecture`). The number of failed
+    evaluations and the time spent on them are logged at the end.
+    """
+    summary = limits.EvaluationSummary()
     for evaluation_id in range(num_samples):
         inputs, outputs, vs, sst = searcher.sample()
-        results = evaluator.eval(inputs, outputs)
-        results = {'validation_accuracy': .2}
+        eval_kwargs = get_eval_kwargs(sst, fidelity)
+        channel_multiplier = fidelity_lib.get_fidelity(
+            eval_kwargs.get('fidelity'))['channel_multiplier']
+        if channel_multiplier != 1.0:
+            inputs, outputs = fidelity_lib.build_architecture(
+                search_space_factory_fn, vs, channel_multiplier)
+        results = evaluator.eval(inputs, outputs, **eval_kwargs)
+        searcher.update(results['validation_accuracy'], sst)
+        summary.update(results)
+        logger.info('Results evaluation %d:\n\tConfig:%s\n\tResults:%s',
+                    evaluation_id, str(vs), str(results))
+    logger.info('Evaluation summary: %s', str(summary.get_summary()))
+
+
+def run_search_with_pool(searcher, evaluator_pool, num_samples, fidelity=None):
+    """Same as :func:`run_search`, keeping all the workers of the evaluator
+    pool busy. The searcher is updated as the evaluations finish, so it may
+    sample new architectures before earlier ones have been evaluated.
+    """
+    summary = limits.EvaluationSummary()
+    task_id_to_sample = {}
+    num_submitted = 0
+    for evaluation_id in range(num_samples):
+        while (num_submitted < num_samples and
+               len(task_id_to_sample) < evaluator_pool.num_workers):
+            inputs, outputs, vs, sst = searcher.sample()
+            eval_kwargs = get_eval_kwargs(sst, fidelity)
+            task_id = evaluator_pool.submit(
+                vs, eval_kwargs.get('state'),
+                eval_kwargs.get('num_training_epochs'),
+                eval_kwargs.get('fidelity'))
+            task_id_to_sample[task_id] = (vs, sst)
+            num_submitted += 1
+
+        task_id, results, state = evaluator_pool.get_result()
+        vs, sst = task_id_to_sample.pop(task_id)
+        if 'evaluation_state' in sst:
+            sst['evaluation_state'].update(state)
         searcher.update(results['validation_accuracy'], sst)
+        summary.update(results)
         logger.info('Results evaluation %d:\n\tConfig:%s\n\tResults:%s',
                     evaluation_id, str(vs), str(results))
+    logger.info('Evaluation summary: %s', str(summary.get_summary()))
 
 
 def main():
@@ -26,20 +104,95 @@ def main():
                         choices=['genetic', 'nasnet', 'nasbench', 'flat'],
                         default='genetic')
     parser.add_argument('--searcher',
-                        choices=['random', 'mcts', 'smbo', 'evolution'],
+                        choices=[
+                            'random', 'mcts', 'smbo', 'smbo_ensemble',
+                            'evolution'
+                        ],
                         default='random')
     parser.add_argument('--data-dir', required=True)
     parser.add_argument('--tpu-name', default='')
     parser.add_argument('--use-tpu', action='store_true')
     parser.add_argument('--evaluation-dir', default='./scratch')
+    parser.add_argument(
+        '--scratch-quota-in-gb',
+        type=float,
+        help='Disk quota of the model folders in a local evaluation folder.')
     parser.add_argument('--num-samples', type=int, default=128)
+    parser.add_argument('--num-training-epochs', type=int, default=25)
+    parser.add_argument('--successive-halving-min-epochs', type=int, default=0)
+    parser.add_argument('--learning-curve-early-stopping', action='store_true')
+    parser.add_argument('--median-stopping', action='store_true')
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--zero-cost-proxy', choices=zero_cost.PROXY_NAMES)
+    parser.add_argument(
+        '--max-evaluation-time-in-hours',
+        type=float,
+        help='Time limit of each evaluation. With a single worker, it is '
+        'only checked between training and evaluation steps.')
+    parser.add_argument(
+        '--max-memory-in-gb',
+        type=float,
+        help='Resident memory limit of each evaluation. With a single '
+        'worker, it is only checked between training and evaluation steps.')
+    parser.add_argument('--one-shot', action='store_true')
+    parser.add_argument('--train-fraction', type=float, default=1.0)
+    parser.add_argument('--image-size', type=int, default=32)
+    parser.add_argument('--channel-multiplier', type=float, default=1.0)
+    parser.add_argument('--inherit-parent-weights', action='store_true')
+    parser.add_argument('--fine-tuning-fraction', type=float, default=.25)
+    parser.add_argument('--max-num-parameters', type=int)
+    parser.add_argument('--max-num-flops', type=int)
+    parser.add_argument('--max-activation-memory-in-gb', type=float)
 
     args = parser.parse_args()
+    max_evaluation_time_in_seconds = (
+        args.max_evaluation_time_in_hours * 3600.0
+        if args.max_evaluation_time_in_hours is not None else None)
+    max_rss_in_bytes = (int(args.max_memory_in_gb * 2**30)
+                        if args.max_memory_in_gb is not None else None)
+    scratch_quota_in_bytes = (int(args.scratch_quota_in_gb * 2**30)
+                              if args.scratch_quota_in_gb is not None else None)
+    max_activation_memory_in_bytes = (
+        int(args.max_activation_memory_in_gb * 2**30)
+        if args.max_activation_memory_in_gb is not None else None)
+    fidelity = fidelity_lib.get_fidelity({
+        'train_fraction': args.train_fraction,
+        'image_size': args.image_size,
+        'channel_multiplier': args.channel_multiplier
+    })
 
     if args.use_tpu and (args.tpu_name == '' or
                          not args.evaluation_dir.startswith('gs://') or
                          not args.data_dir.startswith('gs://')):
         raise ValueError('If using TPU, TPU arguments need to be provided')
+    if args.use_tpu and args.num_workers > 1:
+        raise ValueError('Multiple workers are only supported without TPU')
+    # the histories used to stop training early are kept by each evaluator.
+    if ((args.learning_curve_early_stopping or args.median_stopping) and
+            args.num_workers > 1):
+        raise ValueError('Early stopping is only supported with a single '
+                         'worker')
+    if args.zero_cost_proxy is not None and args.num_workers > 1:
+        raise ValueError(
+            'Multiple workers are only supported for training evaluations')
+    if args.one_shot and (args.search_space != 'nasbench' or
+                          args.num_workers > 1):
+        raise ValueError('One-shot evaluation is only supported for the '
+                         'nasbench search space with a single worker')
+    if ((args.zero_cost_proxy is not None or args.one_shot) and
+            not fidelity_lib.is_full_fidelity(fidelity)):
+        raise ValueError('Reduced fidelities are only supported for training '
+                         'evaluations')
+    if args.inherit_parent_weights and (args.searcher != 'evolution' or
+                                        args.zero_cost_proxy is not None or
+                                        args.one_shot):
+        raise ValueError('Weight inheritance is only supported for the '
+                         'evolution searcher with training evaluations')
+    # successive halving would delete the folders of the members of the
+    # population that it does not promote.
+    if args.inherit_parent_weights and args.successive_halving_min_epochs > 0:
+        raise ValueError('Weight inheritance is not supported with '
+                         'successive halving')
 
     ssf_fns = {
         'genetic': genetic_space.SSF_Genetic,
@@ -49,6 +202,10 @@ def main():
     }
 
     ssf = ssf_fns[args.search_space]()
+    # the model folders are shared by the evaluator and the searchers, which
+    # delete the folders that they no longer need.
+    scratch_storage = scratch.get_scratch_storage(args.evaluation_dir,
+                                                  scratch_quota_in_bytes)
 
     searcher_fns = {
         'random':
@@ -57,24 +214,101 @@ def main():
         lambda: mcts.MCTSSearcher(ssf.get_search_space, .33),
         'smbo':
         lambda: smbo_random.SMBOSearcher(
-            ssf.get_search_space, hashing.HashingSurrogate(2**16, 1), 512, .1),
+            ssf.get_search_space,
+            surrogates_common.CachedSurrogateModel(
+                hashing.HashingSurrogate(2**16, 1)), 512, .1),
+        'smbo_ensemble':
+        lambda: smbo_random.SMBOSearcher(
+            ssf.get_search_space,
+            ensemble.EnsembleHashingSurrogate(2**16, 1),
+            512,
+            .1,
+            acquisition_fn=ensemble.expected_improvement),
         'evolution':
         lambda: regularized_evolution_searcher.EvolutionSearcher(
             ssf.get_search_space,
             regularized_evolution_searcher.mutatable,
             100,
             25,
-            regularized=True),
+            regularized=True,
+            asynchronous=args.num_workers > 1,
+            inherit_weights=args.inherit_parent_weights,
+            delete_folder_fn=scratch_storage.delete_folder),
     }
     searcher = searcher_fns[args.searcher]()
-    evaluator = tpu_estimator_classification.AdvanceClassifierEvaluator(
+    # rejects the architectures over budget before evaluating them. MCTS is
+    # updated with the rejected architectures so it stops sampling them.
+    if (args.max_num_parameters is not None or
+            args.max_num_flops is not None or
+            max_activation_memory_in_bytes is not None):
+        searcher = budget.BudgetSearcher(
+            searcher,
+            max_num_parameters=args.max_num_parameters,
+            max_num_flops=args.max_num_flops,
+            max_activation_memory_in_bytes=max_activation_memory_in_bytes,
+            image_shape=(args.image_size, args.image_size, 3),
+            rejected_val=0.0 if args.searcher == 'mcts' else None)
+    if args.successive_halving_min_epochs > 0:
+        searcher = successive_halving.SuccessiveHalvingSearcher(
+            searcher,
+            args.successive_halving_min_epochs,
+            args.num_training_epochs,
+            num_samples=args.num_samples,
+            delete_folder_fn=scratch_storage.delete_folder)
+    evaluator_kwargs = {
+        'data_dir':
         args.data_dir,
+        'tpu_name':
         args.tpu_name,
-        25,
-        base_dir=args.evaluation_dir,
-        use_tpu=args.use_tpu)
-
-    run_search(searcher, evaluator, args.num_samples)
+        'max_num_training_epochs':
+        args.num_training_epochs,
+        'base_dir':
+        args.evaluation_dir,
+        'use_tpu':
+        args.use_tpu,
+        'learning_curve_predictor':
+        learning_curve.LearningCurvePredictor()
+        if args.learning_curve_early_stopping else None,
+        'median_stopping':
+        args.median_stopping,
+        # results are only cached for local folders, as SQLite needs a
+        # filesystem with working locks.
+        'result_cache_filepath':
+        None if args.evaluation_dir.startswith('gs://') else os.path.join(
+            args.evaluation_dir, 'evaluation_results.sqlite3'),
+        'max_evaluation_time_in_seconds':
+        max_evaluation_time_in_seconds,
+        'max_rss_in_bytes':
+        max_rss_in_bytes,
+        'fine_tuning_fraction':
+        args.fine_tuning_fraction,
+        'scratch_quota_in_bytes':
+        scratch_quota_in_bytes
+    }
+    if args.num_workers > 1:
+        evaluator_pool = local_pool.LocalEvaluatorPool(
+            args.num_workers,
+            ssf_fns[args.search_space],
+            evaluator_kwargs,
+            max_evaluation_time_in_seconds=max_evaluation_time_in_seconds,
+            max_rss_in_bytes=max_rss_in_bytes)
+        run_search_with_pool(searcher, evaluator_pool, args.num_samples,
+                             fidelity)
+        evaluator_pool.close()
+    else:
+        if args.zero_cost_proxy is not None:
+            evaluator = zero_cost.ZeroCostEvaluator(args.data_dir,
+                                                    args.zero_cost_proxy)
+        elif args.one_shot:
+            evaluator = one_shot.OneShotNasbenchEvaluator(
+                args.data_dir, num_training_epochs=args.num_training_epochs)
+        else:
+            evaluator = tpu_estimator_classification.AdvanceClassifierEvaluator(
+                scratch_storage=scratch_storage, **evaluator_kwargs)
+        run_search(searcher, evaluator, args.num_samples,
+                   ssf_fns[args.search_space], fidelity)
+    if isinstance(scratch_storage, scratch.LocalScratchStorage):
+        scratch_storage.wait_for_deletions()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,338 @@
+"""Static cost model for fully specified architectures.
+
+The costs are computed by propagating shapes through the graph using only the
+names and the hyperparameter values of the modules, so neither Tensorflow nor
+the compilation of the architecture is needed. This allows searchers to reject
+architectures that are over budget before paying for their evaluation.
+
+Shapes do not include the batch dimension: feature maps are
+``(height, width, channels)``, vectors are ``(num_units,)``, and scalars are
+``()``.
+"""
+from six import iteritems, itervalues
+
+import numpy as np
+
+import deep_architect.core as co
+
+
+def _to_pair(x):
+    return tuple(x) if isinstance(x, (list, tuple)) else (x, x)
+
+
+def _get_spatial_output_size(size, kernel_size, stride, dilation_rate,
+                             padding):
+    if padding.upper() == 'SAME':
+        return -(-size // stride)
+    else:
+        effective_kernel_size = (kernel_size - 1) * dilation_rate + 1
+        return max(0, -(-(size - effective_kernel_size + 1) // stride))
+
+
+def _get_window_output_shape(shape, dh, num_channels):
+    kh, kw = _to_pair(dh.get('filter_width', dh.get('kernel_size')))
+    sh, sw = _to_pair(dh.get('stride', 1))
+    dil_h, dil_w = _to_pair(dh.get('dilation_rate', 1))
+    padding = dh.get('padding', 'SAME')
+    return (_get_spatial_output_size(shape[0], kh, sh, dil_h, padding),
+            _get_spatial_output_size(shape[1], kw, sw, dil_w,
+                                     padding), num_channels), kh * kw
+
+
+def _conv2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    out_shape, kernel_area = _get_window_output_shape(shape, dh,
+                                                      dh['num_filters'])
+    num_weights = kernel_area * shape[2] * out_shape[2]
+    num_params = num_weights + (out_shape[2] if dh.get('use_bias', True) else 0)
+    num_flops = 2 * out_shape[0] * out_shape[1] * num_weights
+    return out_shape, num_params, num_flops, False
+
+
+def _separable_conv2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    out_shape, kernel_area = _get_window_output_shape(shape, dh,
+                                                      dh['num_filters'])
+    num_depthwise_channels = shape[2] * dh.get('depth_multiplier', 1)
+    num_weights = (kernel_area * num_depthwise_channels +
+                   num_depthwise_channels * out_shape[2])
+    num_params = num_weights + (out_shape[2] if dh.get('use_bias', True) else 0)
+    num_flops = 2 * out_shape[0] * out_shape[1] * num_weights
+    return out_shape, num_params, num_flops, False
+
+
+def _depthwise_conv2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    num_channels = shape[2] * dh.get('depth_multiplier', 1)
+    out_shape, kernel_area = _get_window_output_shape(shape, dh, num_channels)
+    num_weights = kernel_area * num_channels
+    num_params = num_weights + (num_channels if dh.get('use_bias', True) else 0)
+    num_flops = 2 * out_shape[0] * out_shape[1] * num_weights
+    return out_shape, num_params, num_flops, False
+
+
+def _pool2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    out_shape, kernel_area = _get_window_output_shape(shape, dh, shape[2])
+    return out_shape, 0, int(np.prod(out_shape)) * kernel_area, False
+
+
+def _global_conv2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    num_weights = int(np.prod(shape)) * dh['num_filters']
+    return (1, 1, dh['num_filters']), num_weights, 2 * num_weights, False
+
+
+def _check_filters_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    if shape[2] != dh['filters'] or dh['stride'] > 1:
+        return _conv2d_cost(in_shapes, {
+            'num_filters': dh['filters'],
+            'filter_width': 1,
+            'stride': dh['stride']
+        })
+    else:
+        return shape, 0, 0, True
+
+
+def _maybe_factorized_reduction_cost(in_shapes, dh):
+    shape, final_shape = in_shapes['In0'], in_shapes['In1']
+    if shape[0] == final_shape[0] and shape[2] == final_shape[2]:
+        return shape, 0, 0, True
+    elif shape[0] == final_shape[0]:
+        out_shape, num_params, num_flops, _ = _conv2d_cost(
+            {'In': shape}, {
+                'num_filters': final_shape[2],
+                'filter_width': 1
+            })
+        return (out_shape, num_params + 2 * out_shape[2],
+                num_flops + 2 * int(np.prod(out_shape)), False)
+    else:
+        # two strided paths with half of the filters each.
+        path_shape, num_params, num_flops, _ = _conv2d_cost(
+            {'In': shape}, {
+                'num_filters': final_shape[2] // 2,
+                'filter_width': 1,
+                'stride': 2
+            })
+        out_shape = path_shape[:2] + (2 * path_shape[2],)
+        return (out_shape, 2 * num_params + 2 * out_shape[2],
+                2 * num_flops + 2 * int(np.prod(out_shape)), False)
+
+
+def _elementwise_cost(num_flops_per_element, num_params_per_channel=0):
+
+    def cost_fn(in_shapes, dh):
+        shape = in_shapes['In'] if 'In' in in_shapes else in_shapes['In0']
+        return (shape, num_params_per_channel * shape[-1],
+                num_flops_per_element * int(np.prod(shape)), False)
+
+    return cost_fn
+
+
+def _global_pool2d_cost(in_shapes, dh):
+    shape = in_shapes['In']
+    return (shape[2],), 0, int(np.prod(shape)), False
+
+
+def _flatten_cost(in_shapes, dh):
+    return (int(np.prod(in_shapes['In'])),), 0, 0, True
+
+
+def _fc_layer_cost(in_shapes, dh):
+    num_inputs = int(np.prod(in_shapes['In']))
+    num_weights = num_inputs * dh['num_units']
+    return ((dh['num_units'],), num_weights + dh['num_units'], 2 * num_weights,
+            False)
+
+
+def _add_cost(in_shapes, dh):
+    # inputs with different numbers of channels are truncated to the smallest.
+    shapes = list(itervalues(in_shapes))
+    shape = shapes[0][:-1] + (min(s[-1] for s in shapes),)
+    return shape, 0, (len(shapes) - 1) * int(np.prod(shape)), False
+
+
+def _concat_cost(in_shapes, dh):
+    shapes = [in_shapes['In%d' % i] for i in range(len(in_shapes))]
+    if len(shapes) == 1:
+        return shapes[0], 0, 0, True
+    return shapes[0][:-1] + (sum(s[-1] for s in shapes),), 0, 0, False
+
+
+def _identity_cost(in_shapes, dh):
+    return (in_shapes['In'] if 'In' in in_shapes else in_shapes['In0'], 0, 0,
+            True)
+
+
+# functions that given the input shapes and the hyperparameter values of a
+# module, return the output shape, the number of trainable parameters, the
+# number of FLOPs, and whether the output is a view of the (first) input.
+name_to_cost_fn = {
+    'Conv2D': _conv2d_cost,
+    'SeparableConv2D': _separable_conv2d_cost,
+    'DepthwiseConv2D': _depthwise_conv2d_cost,
+    'MaxPool2D': _pool2d_cost,
+    'MinPool2D': _pool2d_cost,
+    'MaxPooling2D': _pool2d_cost,
+    'AveragePooling2D': _pool2d_cost,
+    'GlobalConv2D': _global_conv2d_cost,
+    'CheckFilters': _check_filters_cost,
+    'MaybeFactorizedReduction': _maybe_factorized_reduction_cost,
+    'BatchNormalization': _elementwise_cost(2, 2),
+    'ReLU': _elementwise_cost(1),
+    'Dropout': _elementwise_cost(1),
+    'DropPath': _elementwise_cost(1),
+    'GlobalAveragePool': _global_pool2d_cost,
+    'GlobalAveragePooling2D': _global_pool2d_cost,
+    'Flatten': _flatten_cost,
+    'FCLayer': _fc_layer_cost,
+    'Dense': _fc_layer_cost,
+    'Add': _add_cost,
+    'Concat': _concat_cost,
+    'ConcatCombiner': _concat_cost,
+    'Identity': _identity_cost,
+    'MISOIdentity': _identity_cost,
+}
+
+
+def get_module_type(m):
+    """Returns the type of the module used to look up its cost function, e.g.,
+    ``Conv2D`` for a module named ``M.Conv2D_3x3-0``."""
+    return m.get_name().split('.', 1)[1].rsplit('-', 1)[0].split('_')[0]
+
+
+def get_architecture_cost(inputs,
+                          outputs,
+                          image_shape=(32, 32, 3),
+                          batch_size=1,
+                          num_bytes_per_element=4):
+    """Computes the costs of a fully specified architecture without compiling
+    it.
+
+    The first input of the architecture (``In`` or ``In0``) is the image, and
+    the other inputs are scalars (e.g., the training progress input of the
+    NASNet search space).
+
+    The peak activation memory is the largest total size of the tensors alive
+    at the same time when running forward with the modules in evaluation
+    order, where a tensor is freed after the last module that uses it. The
+    total activation memory is the size of all the tensors computed, which is
+    the memory needed to keep the activations for backpropagation. Modules
+    that pass their input through unchanged do not allocate memory. A
+    multiply-add counts as two FLOPs.
+
+    Args:
+        inputs (dict[str, deep_architect.core.Input]): Inputs of the
+            architecture.
+        outputs (dict[str, deep_architect.core.Output]): Outputs of the
+            architecture.
+        image_shape (tuple[int]): Shape of the images.
+        batch_size (int): Number of examples for which the FLOPs and the
+            activation memory are computed.
+        num_bytes_per_element (int): Size of the elements of the tensors.
+
+    Returns:
+        dict[str, int]: Dictionary with the keys ``num_parameters``,
+            ``num_flops``, ``peak_activation_memory_in_bytes``, and
+            ``total_activation_memory_in_bytes``.
+
+    Raises:
+        ValueError: If the architecture is not fully specified or has a
+            module for which there is no cost function.
+    """
+    if not co.is_specified(list(itervalues(outputs))):
+        raise ValueError('The architecture is not fully specified.')
+    image_input_name = 'In' if 'In' in inputs else 'In0'
+
+    # tensors are identified by the inputs of the architecture and the outputs
+    # of the modules, and views share the buffer of their input.
+    elem_to_shape = {}
+    elem_to_buffer = {}
+    buffer_to_size = {}
+    buffer_to_num_uses = {}
+    for name, ix in iteritems(inputs):
+        elem_to_shape[ix] = tuple(image_shape) if name == image_input_name else ()
+        elem_to_buffer[ix] = ix
+        buffer_to_size[ix] = int(np.prod(elem_to_shape[ix]))
+        buffer_to_num_uses[ix] = 1
+
+    def get_source(ix):
+        return ix.get_connected_output() if ix.is_connected() else ix
+
+    num_parameters = 0
+    num_flops = 0
+    module_seq = co.determine_module_eval_seq(list(itervalues(inputs)))
+    for m in module_seq:
+        module_type = get_module_type(m)
+        if module_type not in name_to_cost_fn:
+            raise ValueError('No cost function for module: %s' % m.get_name())
+        in_shapes = {
+            name: elem_to_shape[get_source(ix)]
+            for name, ix in iteritems(m.inputs)
+        }
+        dh = {name: h.get_value() for name, h in iteritems(m.hyperps)}
+        out_shape, m_num_parameters, m_num_flops, is_view = name_to_cost_fn[
+            module_type](in_shapes, dh)
+        num_parameters += m_num_parameters
+        num_flops += m_num_flops
+        for ox in itervalues(m.outputs):
+            elem_to_shape[ox] = tuple(out_shape)
+            if is_view:
+                first_ix = list(itervalues(m.inputs))[0]
+                elem_to_buffer[ox] = elem_to_buffer[get_source(first_ix)]
+            else:
+                elem_to_buffer[ox] = ox
+                buffer_to_size[ox] = int(np.prod(out_shape))
+                buffer_to_num_uses[ox] = 0
+        for ix in itervalues(m.inputs):
+            buffer_to_num_uses[elem_to_buffer[get_source(ix)]] += 1
+    # the outputs of the architecture are never freed.
+    for ox in itervalues(outputs):
+        buffer_to_num_uses[elem_to_buffer[ox]] += 1
+
+    live_size = sum(buffer_to_size[ix] for ix in itervalues(inputs))
+    peak_size = live_size
+    for m in module_seq:
+        for ox in itervalues(m.outputs):
+            b = elem_to_buffer[ox]
+            if b is ox:
+                live_size += buffer_to_size[b]
+        peak_size = max(peak_size, live_size)
+        for ix in itervalues(m.inputs):
+            b = elem_to_buffer[get_source(ix)]
+            buffer_to_num_uses[b] -= 1
+            if buffer_to_num_uses[b] == 0:
+                live_size -= buffer_to_size[b]
+        # outputs that are not used anywhere are freed right away.
+        for ox in itervalues(m.outputs):
+            b = elem_to_buffer[ox]
+            if b is ox and buffer_to_num_uses[b] == 0:
+                live_size -= buffer_to_size[b]
+
+    num_bytes = batch_size * num_bytes_per_element
+    return {
+        'num_parameters': num_parameters,
+        'num_flops': batch_size * num_flops,
+        'peak_activation_memory_in_bytes': num_bytes * peak_size,
+        'total_activation_memory_in_bytes':
+        num_bytes * sum(itervalues(buffer_to_size)),
+    }
+
+
+def is_within_budget(cost,
+                     max_num_parameters=None,
+                     max_num_flops=None,
+                     max_activation_memory_in_bytes=None):
+    """Checks the costs returned by :func:`get_architecture_cost` against a
+    budget. Limits that are ``None`` are not checked.
+
+    The activation memory limit is checked against the total activation
+    memory, as this is what training needs.
+    """
+    return ((max_num_parameters is None or
+             cost['num_parameters'] <= max_num_parameters) and
+            (max_num_flops is None or cost['num_flops'] <= max_num_flops) and
+            (max_activation_memory_in_bytes is None or
+             cost['total_activation_memory_in_bytes'] <=
+             max_activation_memory_in_bytes))
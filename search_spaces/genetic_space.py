@@ -124,9 +124,13 @@ def generate_search_space(nodes_per_stage, filters_per_stage,
 
 class SSF_Genetic(mo.SearchSpaceFactory):
 
-    def __init__(self):
+    def __init__(self, channel_multiplier=1.0):
+        filters_per_stage = [
+            max(1, int(round(f * channel_multiplier))) for f in [64, 128, 256]
+        ]
         mo.SearchSpaceFactory.__init__(
             # self, lambda: generate_search_space([3, 4, 5], [8, 16, 32],
             #                                     [5, 5, 5])
             self,
-            lambda: generate_search_space([3, 4, 5], [64, 128, 256], [5, 5, 5]))
+            lambda: generate_search_space([3, 4, 5], filters_per_stage,
+                                          [5, 5, 5]))
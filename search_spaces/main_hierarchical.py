@@ -9,7 +9,8 @@ import deep_architect.modules as mo
 import deep_architect.utils as ut
 from deep_architect.hyperparameters import Discrete as D
 import deep_architect.helpers.tfeager as htfe
-from search_spaces.tfe_ops import batch_normalization
+from search_spaces.tfe_ops import (batch_normalization,
+                                   assigned_hyperparameters)
 
 ###############################################################################
 # Base motifs (level=1, motif_num=6)
@@ -18,12 +19,19 @@ from search_spaces.tfe_ops import batch_normalization
 
 def conv2d(filters, kernel_size, stride=1, activation_fn='linear'):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: Conv2D(filters,
-                       kernel_size,
-                       strides=stride,
-                       padding='same',
-                       activation=activation_fn,
-                       use_bias=False), {},
+        lambda num_filters, filter_width, stride, use_bias: Conv2D(
+            num_filters,
+            filter_width,
+            strides=stride,
+            padding='same',
+            activation=activation_fn,
+            use_bias=use_bias),
+        assigned_hyperparameters({
+            'num_filters': filters,
+            'filter_width': kernel_size,
+            'stride': stride,
+            'use_bias': False
+        }),
         name="Conv2D_%dx%d" % (kernel_size, kernel_size))
 
 
@@ -37,11 +45,17 @@ def conv2d_cell(filters, kernel_size, stride=1):
 
 def depthwise_conv2d(kernel_size, stride=1, activation_fn='linear'):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: DepthwiseConv2D(kernel_size,
-                                strides=stride,
-                                padding='same',
-                                activation=activation_fn,
-                                use_bias=False), {},
+        lambda filter_width, stride, use_bias: DepthwiseConv2D(
+            filter_width,
+            strides=stride,
+            padding='same',
+            activation=activation_fn,
+            use_bias=use_bias),
+        assigned_hyperparameters({
+            'filter_width': kernel_size,
+            'stride': stride,
+            'use_bias': False
+        }),
         name="DepthwiseConv2D_%dx%d" % (kernel_size, kernel_size))
 
 
@@ -54,12 +68,19 @@ def depthwise_conv2d_cell(kernel_size, stride=1):
 
 def separable_conv2d(filters, kernel_size, stride=1, activation_fn='linear'):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: SeparableConv2D(filters,
-                                kernel_size,
-                                strides=stride,
-                                padding='same',
-                                activation=activation_fn,
-                                use_bias=False), {},
+        lambda num_filters, filter_width, stride, use_bias: SeparableConv2D(
+            num_filters,
+            filter_width,
+            strides=stride,
+            padding='same',
+            activation=activation_fn,
+            use_bias=use_bias),
+        assigned_hyperparameters({
+            'num_filters': filters,
+            'filter_width': kernel_size,
+            'stride': stride,
+            'use_bias': False
+        }),
         name="SeparableConv2D_%dx%d" % (kernel_size, kernel_size))
 
 
@@ -74,14 +95,24 @@ def separable_conv2d_cell(filters, kernel_size, stride=1):
 # max-pooling
 def max_pooling(pool_size, stride=1):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: MaxPooling2D(pool_size, strides=stride, padding='same'), {},
+        lambda kernel_size, stride: MaxPooling2D(
+            kernel_size, strides=stride, padding='same'),
+        assigned_hyperparameters({
+            'kernel_size': pool_size,
+            'stride': stride
+        }),
         name="MaxPooling2D_%dx%d" % (pool_size, pool_size))
 
 
 # average-pooling
 def average_pooling(pool_size, stride=1):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: MaxPooling2D(pool_size, strides=stride, padding='same'), {},
+        lambda kernel_size, stride: MaxPooling2D(
+            kernel_size, strides=stride, padding='same'),
+        assigned_hyperparameters({
+            'kernel_size': pool_size,
+            'stride': stride
+        }),
         name="AveragePooling2D_%dx%d" % (pool_size, pool_size))
 
 
@@ -97,7 +128,9 @@ def global_average_pooling():
 
 def dense(units):
     return htfe.siso_tfeager_module_from_tensorflow_op_fn(
-        lambda: Dense(units), {})
+        lambda num_units: Dense(num_units),
+        assigned_hyperparameters({'num_units': units}),
+        name='Dense')
 
 
 # depthwise concatenation
@@ -313,8 +346,7 @@ def create_motif(
 
 
 # NOTE: description on page 6 of paper
-def flat_search_space(num_classes):
-    c0 = 64
+def flat_search_space(num_classes, c0=64):
     kernel_size = 3
     motif_info = {2: {'num_nodes': 11, 'num_motifs': 1}}
 
@@ -340,9 +372,8 @@ def flat_search_space(num_classes):
     ])
 
 
-def hierarchical_search_space(num_classes):
+def hierarchical_search_space(num_classes, c0=64):
 
-    c0 = 64
     kernel_size = 3
     motif_info = {
         2: {
@@ -378,12 +409,15 @@ def hierarchical_search_space(num_classes):
 
 class SSF_Flat(mo.SearchSpaceFactory):
 
-    def __init__(self):
-        mo.SearchSpaceFactory.__init__(self, lambda: flat_search_space(10))
+    def __init__(self, channel_multiplier=1.0):
+        c0 = max(1, int(round(64 * channel_multiplier)))
+        mo.SearchSpaceFactory.__init__(self,
+                                       lambda: flat_search_space(10, c0))
 
 
 class SSF_Hierarchical(mo.SearchSpaceFactory):
 
-    def __init__(self):
+    def __init__(self, channel_multiplier=1.0):
+        c0 = max(1, int(round(64 * channel_multiplier)))
         mo.SearchSpaceFactory.__init__(
-            self, lambda: hierarchical_search_space(10))
+            self, lambda: hierarchical_search_space(10, c0))
@@ -3,6 +3,7 @@ from builtins import str
 from builtins import range
 import itertools
 
+import numpy as np
 import tensorflow as tf
 from collections import OrderedDict
 
@@ -10,11 +11,70 @@ import deep_architect.helpers.tfeager as htfe
 import deep_architect.modules as mo
 from search_spaces.tfe_ops import (relu, batch_normalization, conv2d,
                                    separable_conv2d, avg_pool2d, max_pool2d,
-                                   min_pool2d, fc_layer, global_pool2d, dropout)
+                                   min_pool2d, fc_layer, global_pool2d, dropout,
+                                   assigned_hyperparameters)
 
 from deep_architect.hyperparameters import Discrete as D
 from deep_architect.hyperparameters import Bool
 
+MAX_EDGES = 9
+NODE_OPS = ['conv1', 'conv3', 'max3']
+_valid_connection_masks = {}
+
+
+def get_valid_connection_masks(num_nodes):
+    """Returns the connection patterns for which the cell substitution function
+    does not raise an error.
+
+    Each pattern is encoded as an integer whose i-th bit is the value of the
+    i-th connection, with connections ordered as in
+    ``itertools.combinations(range(num_nodes + 2), 2)``. The table is computed
+    once per number of nodes.
+
+    Args:
+        num_nodes (int): Number of intermediate nodes in the cell.
+
+    Returns:
+        numpy.ndarray: Array with the valid connection patterns.
+    """
+    if num_nodes not in _valid_connection_masks:
+        connections = list(itertools.combinations(range(num_nodes + 2), 2))
+        masks = np.arange(2**len(connections), dtype=np.int64)
+        num_ins = np.zeros((num_nodes + 2, len(masks)), dtype=np.int8)
+        num_outs = np.zeros((num_nodes + 2, len(masks)), dtype=np.int8)
+        for i, (in_id, out_id) in enumerate(connections):
+            bit = ((masks >> i) & 1).astype(np.int8)
+            num_ins[out_id] += bit
+            num_outs[in_id] += bit
+            if (in_id, out_id) == (0, num_nodes + 1):
+                input_output_bit = bit
+
+        is_valid = num_ins[-1] - input_output_bit > 0
+        is_valid &= num_ins.sum(axis=0) <= MAX_EDGES
+        for i in range(1, num_nodes + 1):
+            is_valid &= (num_outs[i] == 0) | (num_ins[i] > 0)
+            is_valid &= (num_ins[i] == 0) | (num_outs[i] > 0)
+        _valid_connection_masks[num_nodes] = masks[is_valid]
+    return _valid_connection_masks[num_nodes]
+
+
+def sample_valid_connections(num_nodes):
+    """Samples uniformly a valid connection pattern for the cell.
+
+    Args:
+        num_nodes (int): Number of intermediate nodes in the cell.
+
+    Returns:
+        dict[str, int]: Dictionary mapping the local names of the connection
+            hyperparameters of the cell to their values.
+    """
+    masks = get_valid_connection_masks(num_nodes)
+    mask = int(masks[np.random.randint(len(masks))])
+    return {
+        '%d_%d' % connection: (mask >> i) & 1 for i, connection in enumerate(
+            itertools.combinations(range(num_nodes + 2), 2))
+    }
+
 
 def cell(input_fn, node_fn, output_fn, h_connections, num_nodes, channels):
 
@@ -40,11 +100,13 @@ def cell(input_fn, node_fn, output_fn, h_connections, num_nodes, channels):
         if num_ins[-1] == 0:
             raise ValueError('No path exists between input and output')
 
-        if sum(num_ins) > 9:
-            raise ValueError('More than 9 edges')
+        if sum(num_ins) > MAX_EDGES:
+            raise ValueError('More than %d edges' % MAX_EDGES)
 
         if dh['%d_%d' % (0, num_nodes + 1)]:
             num_ins[-1] -= 1
+            if num_ins[-1] == 0:
+                raise ValueError('No intermediate node connected to output')
 
         # Compute the number of channels that each vertex outputs
         int_channels = channels // num_ins[-1]
@@ -77,7 +139,11 @@ def cell(input_fn, node_fn, output_fn, h_connections, num_nodes, channels):
                     1, vertex_channels[i]) if num_outs[i] > 0 else None
             for i in range(1, num_nodes + 1)
         ]
-        nodes.append(output_fn(num_ins[num_nodes + 1]))
+        # the connections are also kept in the output module of the cell, as
+        # the cell is removed from the graph once it is substituted.
+        nodes.append(
+            output_fn(num_ins[num_nodes + 1],
+                      {'in_' + name: v for name, v in dh.items()}))
         num_connected = [0] * (num_nodes + 2)
 
         # Project input vertex to correct dimensions if used
@@ -108,13 +174,15 @@ def cell(input_fn, node_fn, output_fn, h_connections, num_nodes, channels):
     for ix, hparam in enumerate(itertools.combinations(range(num_nodes + 2),
                                                        2)):
         name_to_hparam['%d_%d' % hparam] = h_connections[ix]
-    return mo.substitution_module('NasbenchCell',
-                                  name_to_hparam,
-                                  substitution_fn, ['In'], ['Out'],
-                                  scope=None)
+    return mo.substitution_module(
+        'NasbenchCell',
+        name_to_hparam,
+        substitution_fn, ['In'], ['Out'],
+        scope=None,
+        joint_sampler_fn=lambda: sample_valid_connections(num_nodes))
 
 
-def add(num_inputs):
+def add(num_inputs, name_to_hyperp=None):
 
     def compile_fn(di, dh):
         in_channels = [tf.shape(di[inp])[-1] for inp in di]
@@ -126,14 +194,18 @@ def add(num_inputs):
 
         return forward_fn
 
-    return htfe.TFEModule('Add', {}, compile_fn,
+    return htfe.TFEModule('Add',
+                          name_to_hyperp if name_to_hyperp is not None else {},
+                          compile_fn,
                           ['In' + str(i) for i in range(num_inputs)],
                           ['Out']).get_io()
 
 
 def intermediate_node_fn(num_inputs, node_id, filters, cell_ops):
+    # the operation of the node is also kept in its first module, as the or
+    # module is removed from the graph once it is substituted.
     return mo.siso_sequential([
-        add(num_inputs),
+        add(num_inputs, {'node_%d' % node_id: cell_ops[node_id]}),
         mo.siso_or(
             {
                 'conv1': lambda: conv2d(D([filters]), D([1])),
@@ -145,7 +217,11 @@ def intermediate_node_fn(num_inputs, node_id, filters, cell_ops):
     ])
 
 
-def concat(num_ins):
+def concat(num_ins, name_to_val=None):
+    """Concatenates the inputs. Values in ``name_to_val`` are recorded in the
+    module as hyperparameters with the value already assigned."""
+    name_to_hyperp = (assigned_hyperparameters(name_to_val)
+                      if name_to_val is not None else {})
 
     def compile_fn(di, dh):
 
@@ -157,7 +233,7 @@ def concat(num_ins):
 
         return forward_fn
 
-    return htfe.TFEModule('Concat', {}, compile_fn,
+    return htfe.TFEModule('Concat', name_to_hyperp, compile_fn,
                           ['In' + str(i) for i in range(num_ins)],
                           ['Out']).get_io()
 
@@ -169,7 +245,7 @@ def create_cell_generator(num_nodes):
     ]
 
     cell_ops = [
-        D(['conv1', 'conv3', 'max3'], name='node_%d' % i)
+        D(NODE_OPS, name='node_%d' % i)
         for i in range(num_nodes)
     ]
 
@@ -185,9 +261,9 @@ def create_cell_generator(num_nodes):
     return generate
 
 
-def stem():
+def stem(num_filters):
     return mo.siso_sequential([
-        conv2d(D([128]), D([3])),
+        conv2d(D([num_filters]), D([3])),
         batch_normalization(),
         relu(),
     ])
@@ -195,7 +271,7 @@ def stem():
 
 def generate_search_space(stacks, num_cells_per_stack, num_nodes_per_cell,
                           num_init_filters):
-    search_space = [stem()]
+    search_space = [stem(num_init_filters)]
     cell_fn = create_cell_generator(num_nodes_per_cell)
     num_filters = num_init_filters
     for i in range(stacks):
@@ -210,6 +286,7 @@ def generate_search_space(stacks, num_cells_per_stack, num_nodes_per_cell,
 
 class SSF_Nasbench(mo.SearchSpaceFactory):
 
-    def __init__(self):
+    def __init__(self, channel_multiplier=1.0):
+        num_init_filters = max(1, int(round(128 * channel_multiplier)))
         mo.SearchSpaceFactory.__init__(
-            self, lambda: generate_search_space(3, 3, 5, 128))
+            self, lambda: generate_search_space(3, 3, 5, num_init_filters))
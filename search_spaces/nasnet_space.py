@@ -12,7 +12,7 @@ import deep_architect.modules as mo
 from search_spaces.tfe_ops import (relu, batch_normalization, conv2d,
                                    separable_conv2d, avg_pool2d, max_pool2d,
                                    min_pool2d, fc_layer, global_pool2d, dropout,
-                                   add, flatten)
+                                   add, flatten, assigned_hyperparameters)
 
 from deep_architect.hyperparameters import Discrete as D
 
@@ -120,10 +120,10 @@ def check_filters(filters, stride=1):
 
     def compile_fn(di, dh):
         num_filters = di['In'].shape[-1].value
-        if num_filters != filters or stride > 1:
-            conv = tf.keras.layers.Conv2D(filters,
+        if num_filters != dh['filters'] or dh['stride'] > 1:
+            conv = tf.keras.layers.Conv2D(dh['filters'],
                                           1,
-                                          strides=stride,
+                                          strides=dh['stride'],
                                           padding='SAME')
         else:
             conv = None
@@ -133,7 +133,12 @@ def check_filters(filters, stride=1):
 
         return forward_fn
 
-    return htfe.siso_tfeager_module('CheckFilters', compile_fn, {})
+    return htfe.siso_tfeager_module(
+        'CheckFilters', compile_fn,
+        assigned_hyperparameters({
+            'filters': filters,
+            'stride': stride
+        }))
 
 
 def pool_op(filters, filter_size, stride, pool_type):
@@ -512,6 +517,7 @@ def connect_new_cell(cell, inputs):
 
 class SSF_NasnetA(mo.SearchSpaceFactory):
 
-    def __init__(self):
+    def __init__(self, channel_multiplier=1.0):
+        init_filters = max(1, int(round(36 * channel_multiplier)))
         mo.SearchSpaceFactory.__init__(
-            self, lambda: generate_search_space(5, 18, 2, 36, 3.0))
+            self, lambda: generate_search_space(5, 18, 2, init_filters, 3.0))
@@ -3,6 +3,20 @@ from deep_architect.helpers.tfeager import siso_tfeager_module, TFEModule
 from deep_architect.hyperparameters import D
 
 
+def assigned_hyperparameters(name_to_val):
+    """Returns hyperparameters with the values already assigned.
+
+    Used to record values in a module (e.g., for
+    :mod:`search_spaces.cost_model`) without adding hyperparameters for the
+    searchers to specify.
+    """
+    name_to_hyperp = {}
+    for name, v in name_to_val.items():
+        name_to_hyperp[name] = D([v])
+        name_to_hyperp[name].assign_value(v)
+    return name_to_hyperp
+
+
 def max_pool2d(h_kernel_size, h_stride=1, h_padding='SAME'):
 
     def compile_fn(di, dh):
@@ -0,0 +1,71 @@
+from searchers.common import Searcher
+from search_spaces.cost_model import get_architecture_cost, is_within_budget
+
+
+class BudgetSearcher(Searcher):
+    """Rejects the architectures sampled by another searcher that are over
+    a budget, before they are evaluated.
+
+    The costs are computed with the static cost model of
+    :mod:`search_spaces.cost_model`, without compiling the architectures.
+    Architectures are sampled from the wrapped searcher until one is within
+    the budget. The searcher evaluation tokens are the ones of the wrapped
+    searcher.
+
+    Args:
+        searcher (searchers.common.Searcher): Searcher used to sample the
+            architectures.
+        max_num_parameters (int): Maximum number of parameters.
+        max_num_flops (int): Maximum number of FLOPs per example.
+        max_activation_memory_in_bytes (int): Maximum activation memory per
+            example needed for training.
+        image_shape (tuple[int]): Shape of the images.
+        rejected_val (float): If not ``None``, the wrapped searcher is
+            updated with this value for the rejected architectures, e.g., for
+            searchers that would otherwise keep sampling them, such as MCTS.
+        max_num_attempts (int): Number of architectures sampled before giving
+            up.
+    """
+
+    def __init__(self,
+                 searcher,
+                 max_num_parameters=None,
+                 max_num_flops=None,
+                 max_activation_memory_in_bytes=None,
+                 image_shape=(32, 32, 3),
+                 rejected_val=None,
+                 max_num_attempts=1000):
+        Searcher.__init__(self, searcher.search_space_fn)
+        self.searcher = searcher
+        self.max_num_parameters = max_num_parameters
+        self.max_num_flops = max_num_flops
+        self.max_activation_memory_in_bytes = max_activation_memory_in_bytes
+        self.image_shape = image_shape
+        self.rejected_val = rejected_val
+        self.max_num_attempts = max_num_attempts
+        self.num_rejected = 0
+
+    def sample(self):
+        for _ in range(self.max_num_attempts):
+            inputs, outputs, vs, searcher_eval_token = self.searcher.sample()
+            cost = get_architecture_cost(inputs,
+                                         outputs,
+                                         image_shape=self.image_shape)
+            if is_within_budget(cost, self.max_num_parameters,
+                                self.max_num_flops,
+                                self.max_activation_memory_in_bytes):
+                return inputs, outputs, vs, searcher_eval_token
+            self.num_rejected += 1
+            if self.rejected_val is not None:
+                self.searcher.update(self.rejected_val, searcher_eval_token)
+        raise RuntimeError('No architecture within the budget in %d samples' %
+                           self.max_num_attempts)
+
+    def update(self, val, searcher_eval_token):
+        self.searcher.update(val, searcher_eval_token)
+
+    def save_state(self, folder):
+        self.searcher.save_state(folder)
+
+    def load_state(self, folder):
+        self.searcher.load_state(folder)
@@ -1,4 +1,5 @@
 import numpy as np
+from six import iteritems
 import deep_architect.core as co
 import deep_architect.hyperparameters as hp
 
@@ -81,6 +82,54 @@ def random_specify_hyperparameter(hyperp):
     return v
 
 
+def get_joint_sampler_module(hyperp):
+    """Returns a module that depends on the hyperparameter and knows how to
+    sample valid joint assignments for its hyperparameters, if any.
+
+    See the ``joint_sampler_fn`` argument of
+    :class:`deep_architect.modules.SubstitutionModule`.
+
+    Args:
+        hyperp (deep_architect.core.Hyperparameter): Hyperparameter to check.
+
+    Returns:
+        deep_architect.core.Module: Module with a joint sampler or ``None``.
+    """
+    for m in hyperp.modules:
+        if getattr(m, 'joint_sampler_fn', None) is not None:
+            return m
+    return None
+
+
+def random_specify_hyperparameter_jointly(hyperp, joint_assignments):
+    """Choose a random value for an unspecified hyperparameter, taking into
+    account the valid joint assignments of the module it belongs to.
+
+    If the hyperparameter belongs to a module with a joint sampler, a valid
+    joint assignment for all the hyperparameters of that module is sampled the
+    first time one of them is reached, and the value is taken from it.
+    Otherwise, it behaves as :func:`random_specify_hyperparameter`.
+
+    Args:
+        hyperp (deep_architect.core.Hyperparameter): Hyperparameter to specify.
+        joint_assignments (dict[deep_architect.core.Module, dict[deep_architect.core.Hyperparameter, object]]):
+            Joint assignments sampled so far for the model being specified.
+            Updated in place.
+    """
+    m = get_joint_sampler_module(hyperp)
+    if m is None:
+        return random_specify_hyperparameter(hyperp)
+
+    if m not in joint_assignments:
+        name_to_val = m.joint_sampler_fn()
+        joint_assignments[m] = {
+            h: name_to_val[name] for name, h in iteritems(m.hyperps)
+        }
+    v = joint_assignments[m][hyperp]
+    hyperp.assign_value(v)
+    return v
+
+
 def random_specify(output_lst):
     """Chooses random values to all the unspecified hyperparameters.
 
@@ -94,8 +143,9 @@ def random_specify(output_lst):
             search space.
     """
     hyperp_value_lst = []
+    joint_assignments = {}
     for h in co.unassigned_independent_hyperparameter_iterator(output_lst):
-        v = random_specify_hyperparameter(h)
+        v = random_specify_hyperparameter_jointly(h, joint_assignments)
         hyperp_value_lst.append(v)
     return hyperp_value_lst
 
@@ -5,51 +5,83 @@ from __future__ import print_function
 
 from builtins import range
 from collections import deque
+import heapq
+import threading
 import sys
 random = sys.modules['random']
 
 from deep_architect.utils import join_paths, write_jsonfile, read_jsonfile, file_exists
 from deep_architect.core import unassigned_independent_hyperparameter_iterator
-from searchers.common import Searcher, random_specify_hyperparameter
+from searchers.common import (Searcher, random_specify_hyperparameter,
+                              random_specify_hyperparameter_jointly)
 
 
 def mutatable(h):
     return len(h.vs) > 1
 
 
-def mutate(output_lst, user_vs, all_vs, mutatable_fn, search_space_fn):
-    mutate_candidates = []
-    new_vs = list(user_vs)
-    for i, h in enumerate(
-            unassigned_independent_hyperparameter_iterator(output_lst)):
-        if mutatable_fn(h):
-            mutate_candidates.append(h)
-        h.assign_value(all_vs[i])
+def mutate(output_lst, user_vs, mutatable_fn):
+    """Specifies the search space with the values of the parent, changing the
+    value of a single mutatable hyperparameter.
 
-    # mutate a random hyperparameter
-    assert len(mutate_candidates) == len(user_vs)
-    m_ind = random.randint(0, len(mutate_candidates) - 1)
-    m_h = mutate_candidates[m_ind]
-    v = m_h.vs[random.randint(0, len(m_h.vs) - 1)]
+    The mutation is applied while the search space is being specified, so the
+    child only requires building the search space once, rather than once for
+    the parent and once for the child. The cost of a mutation is still the
+    cost of building and specifying the whole search space, which grows with
+    the size of the network, not with the size of the mutated part: the
+    substitution modules of the parent are gone once specified, so the parts
+    of its graph that the mutation does not affect cannot be reused. If the
+    mutated hyperparameter belongs to a substitution, the mutatable
+    hyperparameters after it are sampled randomly, as they may not exist in
+    the parent.
 
-    # ensure that same value is not chosen again
-    while v == user_vs[m_ind]:
-        v = m_h.vs[random.randint(0, len(m_h.vs) - 1)]
-    new_vs[m_ind] = v
-    if 'sub' in m_h.get_name():
-        new_vs = new_vs[:m_ind + 1]
+    Args:
+        output_lst (list[deep_architect.core.Output]): Outputs of an
+            unspecified search space.
+        user_vs (list[object]): Values of the mutatable hyperparameters of
+            the parent.
+        mutatable_fn ((deep_architect.core.Hyperparameter) -> bool): Whether
+            the hyperparameter can be mutated.
 
-    inputs, outputs = search_space_fn()
-    output_lst = list(outputs.values())
-    all_vs = specify_evolution(output_lst, mutatable_fn, new_vs)
-    return inputs, outputs, new_vs, all_vs
+    Returns:
+        (list[object], list[object]):
+            Values of the mutatable hyperparameters and values of all the
+            hyperparameters of the child.
+    """
+    # mutate a random hyperparameter
+    m_ind = random.randint(0, len(user_vs) - 1)
+    new_user_vs = list(user_vs)
+    new_all_vs = []
+    vs_idx = 0
+    for h in unassigned_independent_hyperparameter_iterator(output_lst):
+        if mutatable_fn(h):
+            if vs_idx == m_ind:
+                v = h.vs[random.randint(0, len(h.vs) - 1)]
+                # ensure that same value is not chosen again
+                while v == user_vs[m_ind]:
+                    v = h.vs[random.randint(0, len(h.vs) - 1)]
+                new_user_vs[m_ind] = v
+                if 'sub' in h.get_name():
+                    del new_user_vs[m_ind + 1:]
+            elif vs_idx < len(new_user_vs):
+                v = new_user_vs[vs_idx]
+            else:
+                v = h.vs[random.randint(0, len(h.vs) - 1)]
+                new_user_vs.append(v)
+            h.assign_value(v)
+            vs_idx += 1
+        else:
+            v = random_specify_hyperparameter(h)
+        new_all_vs.append(v)
+    return new_user_vs, new_all_vs
 
 
 def random_specify_evolution(output_lst, mutatable_fn):
     user_vs = []
     all_vs = []
+    joint_assignments = {}
     for h in unassigned_independent_hyperparameter_iterator(output_lst):
-        v = random_specify_hyperparameter(h)
+        v = random_specify_hyperparameter_jointly(h, joint_assignments)
         if mutatable_fn(h):
             user_vs.append(v)
         all_vs.append(v)
@@ -73,85 +105,246 @@ def specify_evolution(output_lst, mutatable_fn, user_vs):
     return vs
 
 
+class Population:
+    """Population of evaluated models for the evolution searcher.
+
+    Each member is a ``(user_vs, all_vs, val)`` tuple, optionally followed
+    by the model folder of the evaluation of the member. Members are kept in a
+    dense list to sample them uniformly in time proportional to the sample
+    size. The age order is kept in a queue and the performance order in a
+    heap, so both the oldest and the weakest member can be removed cheaply.
+    Members removed through one of the structures are removed lazily from the
+    other one.
+
+    Args:
+        maxlen (int, optional): Maximum number of members. When a member is
+            added to a full population, the oldest member is removed.
+    """
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.next_id = 0
+        self.id_to_member = {}
+        self.id_to_pos = {}
+        self.ids = []
+        self.age_queue = deque()
+        self.val_heap = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, member):
+        """Adds a member. Returns the oldest member if it is removed because
+        the population is full, and ``None`` otherwise."""
+        member_id = self.next_id
+        self.next_id += 1
+        self.id_to_member[member_id] = member
+        self.id_to_pos[member_id] = len(self.ids)
+        self.ids.append(member_id)
+        self.age_queue.append(member_id)
+        # ties in performance are broken in favor of the oldest member.
+        heapq.heappush(self.val_heap, (member[2], member_id))
+        if self.maxlen is not None and len(self.ids) > self.maxlen:
+            return self.remove_oldest()
+        return None
+
+    def remove_oldest(self):
+        while self.age_queue[0] not in self.id_to_member:
+            self.age_queue.popleft()
+        return self._remove(self.age_queue.popleft())
+
+    def remove_weakest(self):
+        while self.val_heap[0][1] not in self.id_to_member:
+            heapq.heappop(self.val_heap)
+        _, member_id = heapq.heappop(self.val_heap)
+        return self._remove(member_id)
+
+    def sample_strongest(self, sample_size):
+        """Returns the best member of a uniformly sampled subset of the
+        population of the desired size. Ties are broken in favor of the oldest
+        member.
+        """
+        sample_pos = random.sample(range(len(self.ids)),
+                                   min(sample_size, len(self.ids)))
+        best_id = max((self.ids[pos] for pos in sample_pos),
+                      key=lambda member_id:
+                      (self.id_to_member[member_id][2], -member_id))
+        return self.id_to_member[best_id]
+
+    def to_list(self):
+        """Returns the members of the population from oldest to newest."""
+        return [
+            self.id_to_member[member_id]
+            for member_id in self.age_queue
+            if member_id in self.id_to_member
+        ]
+
+    def _remove(self, member_id):
+        # swap with the last member to keep the list of members dense.
+        pos = self.id_to_pos.pop(member_id)
+        last_id = self.ids.pop()
+        if last_id != member_id:
+            self.ids[pos] = last_id
+            self.id_to_pos[last_id] = pos
+        member = self.id_to_member.pop(member_id)
+
+        # compact the structures once they are mostly made of removed members.
+        if len(self.age_queue) > 2 * len(self.ids) + 1:
+            self.age_queue = deque(
+                i for i in self.age_queue if i in self.id_to_member)
+        if len(self.val_heap) > 2 * len(self.ids) + 1:
+            self.val_heap = [
+                x for x in self.val_heap if x[1] in self.id_to_member
+            ]
+            heapq.heapify(self.val_heap)
+        return member
+
+
 class EvolutionSearcher(Searcher):
+    """Regularized evolution searcher.
 
-    def __init__(self, search_space_fn, mutatable_fn, P, S, regularized=False):
+    In the default mode, each call to ``update`` is assumed to follow the
+    corresponding call to ``sample``. In the asynchronous mode, any number of
+    architectures may be sampled before their results are reported, and the
+    results may be reported in any order, as in the steady-state setup of
+    Real et al. '18. The first ``P`` samples are random architectures, and
+    once all architectures in flight have been reported, the population
+    stays at size ``P``, with the oldest (or weakest, if not regularized)
+    member removed for each new member added. Sampling and updating are
+    thread-safe in this mode.
+
+    With ``inherit_weights``, the searcher evaluation token carries an
+    evaluation state (see :func:`main.get_eval_kwargs`), where the evaluator
+    stores the model folder. The model folder of each member is kept in the
+    population, and the evaluation state of a child has the model folder of
+    its parent as ``parent_model_dir``, so that the evaluator can initialize
+    the child with the weights of its parent (see
+    :class:`evaluators.tpu_estimator_classification.AdvanceClassifierEvaluator`).
+    The evaluation state also asks the evaluator to keep the model folder.
+    If ``delete_folder_fn`` is given, it is called with the model folder of
+    a member once the member is removed from the population and no child
+    being evaluated inherits from it.
+    """
+
+    def __init__(self,
+                 search_space_fn,
+                 mutatable_fn,
+                 P,
+                 S,
+                 regularized=False,
+                 asynchronous=False,
+                 inherit_weights=False,
+                 delete_folder_fn=None):
         Searcher.__init__(self, search_space_fn)
         # Population size
         self.P = P
         # Sample size
         self.S = S
 
-        self.population = deque(maxlen=P)
+        self.population = Population(maxlen=P)
         self.regularized = regularized
         self.initializing = True
         self.mutatable = mutatable_fn
+        self.asynchronous = asynchronous
+        self.inherit_weights = inherit_weights
+        self.delete_folder_fn = delete_folder_fn
+        # number of members and of children being evaluated that use each
+        # model folder.
+        self.model_dir_to_num_refs = {}
+        # number of random architectures handed out in the asynchronous mode.
+        self.num_initial_samples = 0
+        self._lock = threading.Lock()
 
     def sample(self):
-        if self.initializing:
+        # the lock is only held to read the population. The search space is
+        # built and mutated outside of it, as the default scope is per thread.
+        with self._lock:
+            if self.asynchronous:
+                initializing = (self.num_initial_samples < self.P or
+                                len(self.population) == 0)
+                if self.num_initial_samples < self.P:
+                    self.num_initial_samples += 1
+            else:
+                initializing = self.initializing
+                if initializing and len(self.population) >= self.P - 1:
+                    self.initializing = False
+            if not initializing:
+                # mutate strongest model
+                parent = self.population.sample_strongest(self.S)
+                if self.inherit_weights and len(parent) > 3:
+                    self._add_ref(parent[3])
+
+        evaluation_state = {'keep_model_dir': True}
+        if initializing:
             inputs, outputs = self.search_space_fn()
             user_vs, all_vs = random_specify_evolution(list(outputs.values()),
                                                        self.mutatable)
-            if len(self.population) >= self.P - 1:
-                self.initializing = False
-            return inputs, outputs, all_vs, {
-                'user_vs': user_vs,
-                'all_vs': all_vs
-            }
         else:
-            sample_inds = sorted(
-                random.sample(list(range(len(self.population))),
-                              min(self.S, len(self.population))))
-
-            # mutate strongest model
-            inputs, outputs = self.search_space_fn()
-            user_vs, all_vs, _ = self.population[self.get_strongest_model_index(
-                sample_inds)]
-            inputs, outputs, new_user_vs, new_all_vs = mutate(
-                list(outputs.values()), user_vs, all_vs, self.mutatable,
-                self.search_space_fn)
+            parent_user_vs = parent[0]
+            if len(parent) > 3 and parent[3] is not None:
+                evaluation_state['parent_model_dir'] = parent[3]
+            # a mutation may lead to an invalid architecture.
+            while True:
+                try:
+                    inputs, outputs = self.search_space_fn()
+                    user_vs, all_vs = mutate(list(outputs.values()),
+                                             parent_user_vs, self.mutatable)
+                    break
+                except ValueError:
+                    pass
 
-            return inputs, outputs, new_all_vs, {
-                'user_vs': new_user_vs,
-                'all_vs': new_all_vs
-            }
+        searcher_eval_token = {'user_vs': user_vs, 'all_vs': all_vs}
+        if self.inherit_weights:
+            searcher_eval_token['evaluation_state'] = evaluation_state
+        return inputs, outputs, all_vs, searcher_eval_token
 
     def update(self, val, cfg_d):
-        if not self.initializing:
-            weak_ind = self.get_weakest_model_index()
-            del self.population[weak_ind]
-        self.population.append((cfg_d['user_vs'], cfg_d['all_vs'], val))
-
-    def get_weakest_model_index(self):
-        if self.regularized:
-            return 0
-        else:
-            min_acc = 1.
-            min_acc_ind = -1
-            for i in range(len(self.population)):
-                _, _, acc = self.population[i]
-                if acc < min_acc:
-                    min_acc = acc
-                    min_acc_ind = i
-            return min_acc_ind
-
-    def get_strongest_model_index(self, sample_inds):
-        max_acc = 0.
-        max_acc_ind = -1
-        for i in range(len(sample_inds)):
-            _, _, acc = self.population[sample_inds[i]]
-            if acc > max_acc:
-                max_acc = acc
-                max_acc_ind = i
-        return sample_inds[max_acc_ind]
+        with self._lock:
+            if self.asynchronous:
+                is_full = len(self.population) >= self.P
+            else:
+                is_full = not self.initializing
+            removed_members = []
+            if is_full:
+                if self.regularized:
+                    removed_members.append(self.population.remove_oldest())
+                else:
+                    removed_members.append(self.population.remove_weakest())
+            member = (cfg_d['user_vs'], cfg_d['all_vs'], val)
+            if 'evaluation_state' in cfg_d:
+                evaluation_state = cfg_d['evaluation_state']
+                member += (evaluation_state.get('model_dir'),)
+                self._add_ref(member[3])
+                self._remove_ref(evaluation_state.get('parent_model_dir'))
+            removed_members.append(self.population.append(member))
+            for removed_member in removed_members:
+                if removed_member is not None and len(removed_member) > 3:
+                    self._remove_ref(removed_member[3])
+
+    def _add_ref(self, model_dir):
+        if model_dir is not None:
+            self.model_dir_to_num_refs[model_dir] = (
+                self.model_dir_to_num_refs.get(model_dir, 0) + 1)
+
+    def _remove_ref(self, model_dir):
+        if model_dir is None or model_dir not in self.model_dir_to_num_refs:
+            return
+        self.model_dir_to_num_refs[model_dir] -= 1
+        if self.model_dir_to_num_refs[model_dir] == 0:
+            del self.model_dir_to_num_refs[model_dir]
+            if self.delete_folder_fn is not None:
+                self.delete_folder_fn(model_dir)
 
     def get_searcher_state_token(self):
         return {
             "P": self.P,
             "S": self.S,
-            "population": list(self.population),
+            "population": self.population.to_list(),
             "regularized": self.regularized,
             "initializing": self.initializing,
+            "asynchronous": self.asynchronous,
+            "num_initial_samples": self.num_initial_samples,
+            "inherit_weights": self.inherit_weights,
         }
 
     def save_state(self, folder_name):
@@ -168,5 +361,14 @@ class EvolutionSearcher(Searcher):
         self.P = state["P"]
         self.S = state["S"]
         self.regularized = state['regularized']
-        self.population = deque(state['population'])
-        self.initializing = state['initializing']
\ No newline at end of file
+        self.population = Population(maxlen=self.P)
+        self.model_dir_to_num_refs = {}
+        for member in state['population']:
+            self.population.append(tuple(member))
+            if len(member) > 3:
+                self._add_ref(member[3])
+        self.initializing = state['initializing']
+        self.asynchronous = state.get('asynchronous', False)
+        self.num_initial_samples = state.get('num_initial_samples',
+                                             len(self.population))
+        self.inherit_weights = state.get('inherit_weights', False)
\ No newline at end of file
@@ -1,59 +1,118 @@
+import deep_architect.utils as ut
 from searchers.common import random_specify, specify, Searcher
-from surrogates.common import extract_features
+from surrogates.common import FeatureExtractor, get_values_key
 import numpy as np
 
 
 class SMBOSearcher(Searcher):
+    """Sequential model based optimization searcher.
 
-    def __init__(self, search_space_fn, surrogate_model, num_samples,
-                 exploration_prob):
+    Samples ``num_samples`` random architectures and returns the one that the
+    surrogate model scores highest. By default, architectures are scored with
+    the prediction of the surrogate model. If an acquisition function is
+    given (e.g., :func:`surrogates.ensemble.expected_improvement`), the
+    surrogate model must have an ``eval_batch_mean_var`` method (see
+    :class:`surrogates.ensemble.EnsembleHashingSurrogate`). All the candidates
+    are then scored in a single batch, and only the best one is rebuilt.
+
+    If the surrogate model caches predictions by key (see
+    :class:`surrogates.common.CachedSurrogateModel`), candidates are looked up
+    by the values that specified them, and features are only extracted for
+    the ones that are not cached.
+    """
+
+    def __init__(self,
+                 search_space_fn,
+                 surrogate_model,
+                 num_samples,
+                 exploration_prob,
+                 feature_extractor=None,
+                 acquisition_fn=None):
         Searcher.__init__(self, search_space_fn)
         self.surr_model = surrogate_model
         self.num_samples = num_samples
         self.exploration_prob = exploration_prob
+        self.feature_extractor = (feature_extractor if
+                                  feature_extractor is not None else
+                                  FeatureExtractor())
+        self.acquisition_fn = acquisition_fn
+        self.best_val = -np.inf
 
     def sample(self):
         if np.random.rand() < self.exploration_prob:
-            while True:
-                try:
-                    inputs, outputs = self.search_space_fn()
-                    best_vs = random_specify(outputs.values())
-                    break
-                except ValueError:
-                    pass
+            inputs, outputs = self.search_space_fn()
+            best_vs = random_specify(outputs.values())
+            best_feats = self.feature_extractor.extract(inputs, outputs)
+        elif self.acquisition_fn is not None:
+            vs_lst = []
+            feats_lst = []
+            for i in range(self.num_samples):
+                inputs, outputs = self.search_space_fn()
+                vs_lst.append(random_specify(outputs.values()))
+                feats_lst.append(
+                    self.feature_extractor.extract(inputs, outputs))
+            means, variances = self.surr_model.eval_batch_mean_var(feats_lst)
+            best_idx = int(
+                np.argmax(self.acquisition_fn(means, variances,
+                                              self.best_val)))
+            best_vs = vs_lst[best_idx]
+            best_feats = feats_lst[best_idx]
+            inputs, outputs = self.search_space_fn()
+            specify(outputs.values(), best_vs)
         else:
             best_model = None
             best_vs = None
             best_score = -np.inf
             for i in range(self.num_samples):
-                while True:
-                    try:
-                        inputs, outputs = self.search_space_fn()
-                        vs = random_specify(outputs.values())
-                        break
-                    except ValueError:
-                        pass
-
-                feats = extract_features(inputs, outputs)
-                score = self.surr_model.eval(feats)
+                inputs, outputs = self.search_space_fn()
+                vs = random_specify(outputs.values())
+
+                score = self._eval(inputs, outputs, vs)
                 if score > best_score:
                     best_model = (inputs, outputs)
                     best_vs = vs
                     best_score = score
 
             inputs, outputs = best_model
+            best_feats = self.feature_extractor.extract(inputs, outputs)
 
-        searcher_eval_token = {'vs': best_vs}
+        # NOTE: the features are kept in the token so that update does not
+        # have to rebuild and re-specify the graph to recompute them.
+        searcher_eval_token = {'vs': best_vs, 'feats': best_feats}
         return inputs, outputs, best_vs, searcher_eval_token
 
+    def _eval(self, inputs, outputs, vs):
+        get_feats_fn = lambda: self.feature_extractor.extract(inputs, outputs)
+        if hasattr(self.surr_model, 'eval_by_key'):
+            return self.surr_model.eval_by_key(get_values_key(vs),
+                                               get_feats_fn)
+        return self.surr_model.eval(get_feats_fn())
+
     def update(self, val, searcher_eval_token):
-        (inputs, outputs) = self.search_space_fn()
-        specify(outputs.values(), searcher_eval_token['vs'])
-        feats = extract_features(inputs, outputs)
+        self.best_val = max(self.best_val, val)
+        if 'feats' in searcher_eval_token:
+            feats = searcher_eval_token['feats']
+        else:
+            # tokens from before features were kept in the token.
+            (inputs, outputs) = self.search_space_fn()
+            specify(outputs.values(), searcher_eval_token['vs'])
+            feats = self.feature_extractor.extract(inputs, outputs)
         self.surr_model.update(val, feats)
 
     def save_state(self, folder):
         self.surr_model.save_state(folder)
+        ut.write_jsonfile({'best_val': self.best_val},
+                          ut.join_paths([folder, 'smbo_searcher.json']))
 
     def load_state(self, folder):
         self.surr_model.load_state(folder)
+        filepath = ut.join_paths([folder, 'smbo_searcher.json'])
+        if ut.file_exists(filepath):
+            self.best_val = ut.read_jsonfile(filepath)['best_val']
+        else:
+            # states saved before the best value was kept; it is recomputed
+            # from the data of the surrogate model, if available.
+            surr_model = getattr(self.surr_model, 'surr_model',
+                                 self.surr_model)
+            vals = getattr(surr_model, 'vals_lst', [])
+            self.best_val = max(vals) if len(vals) > 0 else -np.inf
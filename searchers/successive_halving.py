@@ -0,0 +1,196 @@
+import os
+
+import deep_architect.utils as ut
+from searchers.common import specify, Searcher
+
+
+def get_training_budgets(min_num_training_epochs, max_num_training_epochs,
+                         eta):
+    """Returns the increasing training budgets used by successive halving.
+
+    Budgets grow geometrically by a factor of ``eta``, starting at the
+    minimum budget, and the last budget is always the maximum budget.
+    """
+    assert eta > 1 and 0 < min_num_training_epochs <= max_num_training_epochs
+    budgets = [min_num_training_epochs]
+    while budgets[-1] * eta < max_num_training_epochs:
+        budgets.append(budgets[-1] * eta)
+    if budgets[-1] < max_num_training_epochs:
+        budgets.append(max_num_training_epochs)
+    return budgets
+
+
+class SuccessiveHalvingSearcher(Searcher):
+    """Asynchronous successive halving on top of another searcher.
+
+    New architectures are sampled from the wrapped searcher and are first
+    evaluated with the smallest training budget. An architecture evaluated
+    with some budget is promoted to the next budget, ``eta`` times larger,
+    once it is among the top ``1 / eta`` of the architectures evaluated with
+    that budget. Promotions are preferred over sampling new architectures.
+
+    The searcher evaluation token carries the number of training epochs and
+    the evaluation state (e.g., the model folder) that the evaluator should
+    use, see :func:`main.get_eval_kwargs`. Reusing the evaluation state lets
+    promoted architectures resume training from their checkpoint. The wrapped
+    searcher is updated once per architecture that it sampled, with the
+    result of the smallest budget.
+
+    The model folders of architectures that are not promoted are kept until
+    they can no longer be promoted. If the total number of samples is known,
+    an architecture that would need more architectures to be evaluated with
+    its budget than the samples left can no longer be promoted, and its model
+    folder is deleted with ``delete_folder_fn`` as soon as this happens. Once
+    all samples are taken, the folders of all the architectures that were not
+    promoted are deleted.
+
+    Args:
+        searcher (searchers.common.Searcher): Searcher used to sample new
+            architectures.
+        min_num_training_epochs (int): Smallest training budget.
+        max_num_training_epochs (int): Largest training budget.
+        eta (int): Reduction factor between consecutive budgets.
+        num_samples (int): Total number of samples of the search. Folders are
+            never deleted if ``None``.
+        delete_folder_fn ((str) -> None): Deletes a model folder, e.g.,
+            :meth:`evaluators.scratch.ScratchStorage.delete_folder`.
+    """
+
+    def __init__(self,
+                 searcher,
+                 min_num_training_epochs,
+                 max_num_training_epochs,
+                 eta=3,
+                 num_samples=None,
+                 delete_folder_fn=None):
+        Searcher.__init__(self, searcher.search_space_fn)
+        self.searcher = searcher
+        self.eta = eta
+        self.budgets = get_training_budgets(min_num_training_epochs,
+                                            max_num_training_epochs, eta)
+        # for each architecture, the values to replay it and its evaluation state.
+        self.configs = []
+        # for each budget, the (config id, value) pairs reported so far and the
+        # ids of the configs that have been promoted to the next budget.
+        self.rungs = [[] for _ in self.budgets]
+        self.promoted = [set() for _ in self.budgets]
+        self.num_samples = num_samples
+        self.delete_folder_fn = delete_folder_fn
+        self.num_sampled = 0
+        # for each budget, the number of evaluations not reported yet.
+        self.num_pending = [0 for _ in self.budgets]
+        # ids of the configs whose model folder was deleted.
+        self.deleted = set()
+
+    def sample(self):
+        self.num_sampled += 1
+        for rung_idx in reversed(range(len(self.budgets) - 1)):
+            config_id = self._get_promotable_config(rung_idx)
+            if config_id is not None:
+                self.promoted[rung_idx].add(config_id)
+                self.num_pending[rung_idx + 1] += 1
+                config = self.configs[config_id]
+                inputs, outputs = self.search_space_fn()
+                specify(outputs.values(), config['vs'])
+                return inputs, outputs, config['vs'], {
+                    'config_id': config_id,
+                    'rung_idx': rung_idx + 1,
+                    'num_training_epochs': self.budgets[rung_idx + 1],
+                    'evaluation_state': config['evaluation_state']
+                }
+
+        inputs, outputs, vs, searcher_eval_token = self.searcher.sample()
+        config_id = len(self.configs)
+        self.num_pending[0] += 1
+        # the evaluation state is shared with the wrapped searcher, e.g., for
+        # the evolution searcher to keep track of the model folders.
+        self.configs.append({
+            'vs': vs,
+            'evaluation_state': searcher_eval_token.get('evaluation_state', {})
+        })
+        return inputs, outputs, vs, {
+            'config_id': config_id,
+            'rung_idx': 0,
+            'num_training_epochs': self.budgets[0],
+            'evaluation_state': self.configs[config_id]['evaluation_state'],
+            'searcher_eval_token': searcher_eval_token
+        }
+
+    def update(self, val, searcher_eval_token):
+        config_id = searcher_eval_token['config_id']
+        rung_idx = searcher_eval_token['rung_idx']
+        # the token may have been serialized, so the state is copied back.
+        self.configs[config_id]['evaluation_state'] = searcher_eval_token[
+            'evaluation_state']
+        self.rungs[rung_idx].append((config_id, val))
+        self.num_pending[rung_idx] -= 1
+        if rung_idx == 0:
+            self.searcher.update(val,
+                                 searcher_eval_token['searcher_eval_token'])
+        self._delete_unpromotable_folders()
+
+    def _get_promotable_config(self, rung_idx):
+        rung = self.rungs[rung_idx]
+        num_promotable = len(rung) // self.eta
+        top = sorted(rung, key=lambda x: x[1], reverse=True)[:num_promotable]
+        for config_id, _ in top:
+            if config_id not in self.promoted[rung_idx]:
+                return config_id
+        return None
+
+    def _delete_unpromotable_folders(self):
+        if self.num_samples is None or self.delete_folder_fn is None:
+            return
+        num_samples_left = max(0, self.num_samples - self.num_sampled)
+        for rung_idx in range(len(self.budgets) - 1):
+            rung = self.rungs[rung_idx]
+            # each sample left adds at most one architecture to the rung,
+            # and promoting the architecture also takes a sample.
+            max_rung_size = (len(rung) + self.num_pending[rung_idx] +
+                             num_samples_left - 1)
+            ranked = sorted(rung, key=lambda x: x[1], reverse=True)
+            for rank, (config_id, _) in enumerate(ranked):
+                if (config_id in self.promoted[rung_idx] or
+                        config_id in self.deleted):
+                    continue
+                if num_samples_left == 0 or max_rung_size // self.eta <= rank:
+                    self.deleted.add(config_id)
+                    self._delete_folder(config_id)
+
+    def _delete_folder(self, config_id):
+        model_dir = self.configs[config_id]['evaluation_state'].get('model_dir')
+        # results from the result cache share the folder of the evaluation
+        # that they come from, which may still be in use.
+        if model_dir is not None and not any(
+                c['evaluation_state'].get('model_dir') == model_dir
+                for i, c in enumerate(self.configs)
+                if i not in self.deleted):
+            self.delete_folder_fn(model_dir)
+
+    def save_state(self, folder):
+        ut.write_jsonfile(
+            {
+                'eta': self.eta,
+                'budgets': self.budgets,
+                'configs': self.configs,
+                'rungs': self.rungs,
+                'promoted': [sorted(ids) for ids in self.promoted],
+                'num_sampled': self.num_sampled,
+                'num_pending': self.num_pending,
+                'deleted': sorted(self.deleted)
+            }, os.path.join(folder, 'successive_halving_searcher_state.json'))
+        self.searcher.save_state(folder)
+
+    def load_state(self, folder):
+        state = ut.read_jsonfile(
+            os.path.join(folder, 'successive_halving_searcher_state.json'))
+        self.eta = state['eta']
+        self.budgets = state['budgets']
+        self.configs = state['configs']
+        self.rungs = [[tuple(x) for x in rung] for rung in state['rungs']]
+        self.promoted = [set(ids) for ids in state['promoted']]
+        self.num_sampled = state.get('num_sampled', len(self.configs))
+        self.num_pending = state.get('num_pending',
+                                     [0 for _ in self.budgets])
+        self.deleted = set(state.get('deleted', []))
+        self.searcher.load_state(folder)
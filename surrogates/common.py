@@ -1,5 +1,9 @@
+import hashlib
+import struct
+from collections import OrderedDict
+
 import deep_architect.core as co
-from six import iteritems
+from six import iteritems, itervalues
 
 
 class SurrogateModel:
@@ -26,6 +30,24 @@ class SurrogateModel:
         raise NotImplementedError
 
 
+def stable_hash(s, seed=0):
+    """Deterministic 64-bit hash of a string.
+
+    Unlike the built-in ``hash``, which is salted per process, the result is
+    the same across processes and restarts, so hashed features can be saved
+    and shared between workers.
+
+    Args:
+        s (str): String to hash.
+        seed (int): Seed that selects the hash function.
+
+    Returns:
+        int: Hash in ``[0, 2**64)``.
+    """
+    digest = hashlib.md5(('%d:%s' % (seed, s)).encode('utf-8')).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+
 # extract some simple features from the network. useful for smbo surrogate models.
 def extract_features(inputs, outputs):
     """Extract a feature representation of a model represented through inputs and
@@ -75,10 +97,12 @@ def extract_features(inputs, outputs):
                     c_feats = "%s |-> %s" % (ox.get_name(), ix.get_name())
                     connection_feats.append(c_feats)
 
-        # module hyperparameters
+        # module hyperparameters. the global name of the hyperparameter is
+        # left out, as it depends on the order in which the search space
+        # created its hyperparameters.
         for h_localname, h in iteritems(m.hyperps):
-            mh_feats = "%s/%s : %s = %s" % (m.get_name(), h_localname,
-                                            h.get_name(), h.get_value())
+            mh_feats = "%s/%s = %s" % (m.get_name(), h_localname,
+                                       h.get_value())
             module_hyperp_feats.append(mh_feats)
 
     return {
@@ -86,3 +110,215 @@ def extract_features(inputs, outputs):
         'connection_feats': connection_feats,
         'module_hyperp_feats': module_hyperp_feats,
     }
+
+
+class FeatureExtractor:
+    """Extracts the same features as :func:`extract_features`, but as integer
+    feature ids rather than strings.
+
+    Each feature is identified by a small tuple with the same information
+    as the string that :func:`extract_features` returns for it: the name of
+    the module for module features, the local name of the output and the
+    name of the connected input for connection features, and the local name
+    of the hyperparameter and its value for hyperparameter features. These
+    tuples are interned to integer ids. The id of a tuple is the
+    :func:`stable_hash` of the string of the feature, so a surrogate model
+    that hashes strings with the same seed maps both representations to the
+    same buckets, and ids are the same across processes. The string is only
+    formatted and hashed the first time the tuple is seen.
+
+    The ids of the features of each module are also cached, keyed by the
+    name of the module, the local names and values of its hyperparameters,
+    and its connections, so modules that appear in many sampled architectures are
+    featurized only once.
+
+    Args:
+        hash_seed (int): Seed passed to :func:`stable_hash`.
+        max_cache_size (int): Maximum number of modules in the cache, and of
+            interned features. The caches are cleared once they grow beyond
+            this size.
+    """
+
+    def __init__(self, hash_seed=0, max_cache_size=1000000):
+        self.hash_seed = hash_seed
+        self.max_cache_size = max_cache_size
+        self.module_key_to_feats = {}
+        self.feat_key_to_id = {}
+
+    def extract(self, inputs, outputs):
+        """Same as :func:`extract_features`, with integer feature ids.
+
+        Returns:
+            dict[str, list[int]]:
+                Representation of the architecture as a dictionary where each
+                key is associated to a list with different types of features.
+        """
+        module_feats = []
+        connection_feats = []
+        module_hyperp_feats = []
+
+        module_memo = []
+
+        def fn(m):
+            module_memo.append(m)
+
+        co.traverse_backward(outputs.values(), fn)
+
+        for m in module_memo:
+            m_feats, c_feats, mh_feats = self._get_module_feats(m)
+            module_feats.append(m_feats)
+            connection_feats.extend(c_feats)
+            module_hyperp_feats.extend(mh_feats)
+
+        return {
+            'module_feats': module_feats,
+            'connection_feats': connection_feats,
+            'module_hyperp_feats': module_hyperp_feats,
+        }
+
+    def _get_module_feats(self, m):
+        m_name = m.get_name()
+        connections = tuple(
+            (ox_localname, tuple(ix.get_name()
+                                 for ix in ox.get_connected_inputs()))
+            for ox_localname, ox in iteritems(m.outputs)
+            if ox.is_connected())
+        value_keys = tuple((h_localname, get_value_key(h.get_value()))
+                           for h_localname, h in iteritems(m.hyperps))
+        key = (m_name, connections, value_keys)
+
+        if key not in self.module_key_to_feats:
+            if len(self.module_key_to_feats) >= self.max_cache_size:
+                self.module_key_to_feats = {}
+            m_feats = self._intern((m_name,), lambda: m_name)
+            c_feats = [
+                self._intern(
+                    (m_name, ox_localname, ix_name), lambda: "%s |-> %s" %
+                    (m.outputs[ox_localname].get_name(), ix_name))
+                for ox_localname, ix_names in connections
+                for ix_name in ix_names
+            ]
+            mh_feats = [
+                self._intern((m_name, h_localname, value_key),
+                             lambda: "%s/%s = %s" %
+                             (m_name, h_localname, m.hyperps[h_localname].
+                              get_value()))
+                for h_localname, value_key in value_keys
+            ]
+            self.module_key_to_feats[key] = (m_feats, c_feats, mh_feats)
+        return self.module_key_to_feats[key]
+
+    def _intern(self, feat_key, get_feat_str_fn):
+        if feat_key not in self.feat_key_to_id:
+            if len(self.feat_key_to_id) >= self.max_cache_size:
+                self.feat_key_to_id = {}
+            self.feat_key_to_id[feat_key] = stable_hash(get_feat_str_fn(),
+                                                        self.hash_seed)
+        return self.feat_key_to_id[feat_key]
+
+
+def get_value_key(v):
+    """Returns a hashable key for a hyperparameter value. Values that are
+    equal but formatted differently, e.g., ``1`` and ``True``, get different
+    keys."""
+    try:
+        hash(v)
+        return (type(v), v)
+    except TypeError:
+        return (type(v), repr(v))
+
+
+def get_features_fingerprint(feats):
+    """Canonical fingerprint of a feature representation of an architecture.
+
+    Features returned by :func:`extract_features` or
+    :class:`FeatureExtractor` identify the modules, connections and
+    hyperparameter values of a fully specified graph, so architectures with
+    the same fingerprint are the same architecture. The fingerprint does not
+    depend on the order of the features.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    h = hashlib.md5()
+    for name in sorted(feats):
+        h.update(('%s:%s;' % (name, sorted(feats[name]))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_values_key(vs):
+    """Returns a hashable key for the values used to specify an architecture
+    of a search space. Replaying the values gives the same architecture, so
+    the key identifies it in the search space without building features."""
+    try:
+        key = tuple(vs)
+        hash(key)
+        return key
+    except TypeError:
+        return repr(vs)
+
+
+class CachedSurrogateModel(SurrogateModel):
+    """Least recently used cache in front of the predictions of a surrogate
+    model.
+
+    :meth:`eval_by_key` is keyed by a cheap identity of the architecture,
+    e.g., :func:`get_values_key` of the values that were used to specify it,
+    and only extracts the features on a miss. :meth:`eval` is keyed by
+    :func:`get_features_fingerprint`, which needs the features.
+
+    The cache is cleared whenever the ``version`` attribute of the wrapped
+    model changes, which the model increments when its predictions change
+    (e.g., after a refit). For models without this attribute, the cache is
+    cleared on every update.
+
+    Args:
+        surrogate_model (SurrogateModel): Model whose predictions are cached.
+        max_cache_size (int): Maximum number of cached predictions.
+    """
+
+    def __init__(self, surrogate_model, max_cache_size=100000):
+        self.surr_model = surrogate_model
+        self.max_cache_size = max_cache_size
+        self.cache = OrderedDict()
+        self.cache_version = getattr(surrogate_model, 'version', None)
+
+    def eval(self, feats):
+        return self.eval_by_key(get_features_fingerprint(feats), lambda: feats)
+
+    def eval_by_key(self, key, get_feats_fn):
+        """Returns the cached prediction for the key, or the prediction for
+        the features returned by ``get_feats_fn`` if it is not cached.
+
+        Args:
+            key (object): Hashable identity of the architecture. Keys must
+                identify the architecture for the lifetime of the cache,
+                e.g., the values of a fixed search space.
+            get_feats_fn (() -> dict[str, list[object]]): Returns the
+                features of the architecture. Only called on a miss.
+        """
+        version = getattr(self.surr_model, 'version', None)
+        if version != self.cache_version:
+            self.cache.clear()
+            self.cache_version = version
+
+        if key in self.cache:
+            val = self.cache.pop(key)
+        else:
+            val = self.surr_model.eval(get_feats_fn())
+            if len(self.cache) >= self.max_cache_size:
+                self.cache.popitem(last=False)
+        self.cache[key] = val
+        return val
+
+    def update(self, val, feats):
+        self.surr_model.update(val, feats)
+        if not hasattr(self.surr_model, 'version'):
+            self.cache.clear()
+
+    def save_state(self, folder):
+        self.surr_model.save_state(folder)
+
+    def load_state(self, folder):
+        self.surr_model.load_state(folder)
+        self.cache.clear()
@@ -0,0 +1,107 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.stats as stats
+import sklearn.linear_model as lm
+
+from surrogates.hashing import HashingSurrogate
+
+
+class RidgeEnsemble:
+    """Ridge regression heads fit on bootstrap resamples of the same data.
+
+    The coefficients of the heads are kept as the columns of a single matrix,
+    so all the heads are evaluated on a batch with one sparse product.
+    """
+
+    def __init__(self, coefs, intercepts):
+        self.coefs = coefs
+        self.intercepts = intercepts
+
+    def predict_heads(self, X):
+        """Returns a matrix with the prediction of each head (columns) for
+        each row of ``X``."""
+        return np.asarray(X.dot(self.coefs)) + self.intercepts
+
+    def predict_mean_var(self, X):
+        preds = self.predict_heads(X)
+        return preds.mean(axis=1), preds.var(axis=1)
+
+    def predict(self, X):
+        return self.predict_heads(X).mean(axis=1)
+
+
+class EnsembleHashingSurrogate(HashingSurrogate):
+    """Hashing surrogate with an ensemble of ridge regression heads, which
+    gives a predictive mean and variance for each architecture.
+
+    Each head is fit on a bootstrap resample of the evaluations (through
+    sample weights), on the same hashed design matrix as
+    :class:`surrogates.hashing.HashingSurrogate`. :meth:`eval` returns the
+    mean of the heads; :meth:`eval_batch_mean_var` returns the mean and the
+    variance across the heads for a batch of architectures. The incremental
+    mode of the base class is not supported.
+
+    Args:
+        num_heads (int): Number of ridge regression heads.
+        seed (int): Seed for the bootstrap resamples.
+    """
+
+    def __init__(self, hash_size, refit_interval, num_heads=8, seed=None,
+                 **kwargs):
+        assert not kwargs.get('incremental', False)
+        HashingSurrogate.__init__(self, hash_size, refit_interval, **kwargs)
+        self.num_heads = num_heads
+        self.rand = np.random.RandomState(seed)
+
+    def eval_batch_mean_var(self, feats_lst):
+        """Predictive mean and variance for a list of feature representations.
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): Means and variances of the
+                predictions for each of the architectures.
+        """
+        model = self.model
+        if model == None:
+            return np.zeros(len(feats_lst)), np.zeros(len(feats_lst))
+        else:
+            return model.predict_mean_var(self._feats_lst2mat(feats_lst))
+
+    def _fit_model(self, vecs_lst, vals_lst):
+        X = sp.vstack(vecs_lst, format='csr')
+        y = np.array(vals_lst)
+        num_evals = len(vals_lst)
+        coefs = np.zeros((self.hash_size, self.num_heads))
+        intercepts = np.zeros(self.num_heads)
+        for i in range(self.num_heads):
+            weights = self.rand.multinomial(num_evals,
+                                            np.ones(num_evals) / num_evals)
+            model = lm.Ridge(alpha=self.weight_decay_coeff)
+            model.fit(X, y, sample_weight=weights.astype('float'))
+            coefs[:, i] = model.coef_
+            intercepts[i] = model.intercept_
+        return RidgeEnsemble(coefs, intercepts)
+
+
+def upper_confidence_bound(means, variances, best_val, beta=1.0):
+    """Upper confidence bound acquisition function (higher is better).
+
+    ``best_val`` is not used, and is only there so that all the acquisition
+    functions have the same signature.
+    """
+    return means + beta * np.sqrt(variances)
+
+
+def expected_improvement(means, variances, best_val, xi=0.0):
+    """Expected improvement over ``best_val`` acquisition function, for
+    Gaussian predictive distributions (higher is better).
+
+    Falls back to the means while there is no ``best_val``.
+    """
+    if best_val is None or not np.isfinite(best_val):
+        return means
+    stds = np.sqrt(variances)
+    improvement = means - best_val - xi
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = improvement / stds
+        ei = improvement * stats.norm.cdf(z) + stds * stats.norm.pdf(z)
+    return np.where(stds > 0, ei, np.maximum(improvement, 0.0))
@@ -1,11 +1,58 @@
 import os
+import threading
 import sklearn.linear_model as lm
 import scipy.sparse as sp
 import numpy as np
-from six import iteritems, itervalues
+from six import iteritems, itervalues, integer_types
 
 import deep_architect.utils as ut
-from surrogates.common import SurrogateModel
+from surrogates.common import SurrogateModel, stable_hash
+from surrogates.storage import SparseRowStore
+
+
+class OnlineRidgeRegressor:
+    """Ridge regression with an unpenalized intercept fit by stochastic
+    gradient descent, one pass over the examples as they arrive.
+
+    Each example takes a normalized gradient step on its squared error plus
+    the weight decay, with step size ``learning_rate / (1 + ||x||^2)``, where
+    the one accounts for the intercept. The weights are kept as a scale
+    times a vector, so the weight decay only updates the scale, and an
+    example costs time proportional to its number of nonzero features,
+    independently of the number of features and of examples seen.
+
+    Args:
+        num_feats (int): Number of features of the examples.
+        alpha (float): Weight decay coefficient.
+        learning_rate (float): Step size relative to the squared norm of the
+            example. Should be in ``(0, 2)`` for the steps to be stable.
+    """
+
+    def __init__(self, num_feats, alpha, learning_rate=.5):
+        self.num_feats = num_feats
+        self.alpha = alpha
+        self.learning_rate = learning_rate
+        self.v = np.zeros(num_feats)
+        self.scale = 1.0
+        self.intercept = 0.0
+
+    def update(self, vec, val):
+        """Takes a step on an example given as a sparse row vector."""
+        vec = vec.tocsr()
+        idxs = vec.indices
+        data = vec.data
+        residual = self.scale * self.v[idxs].dot(data) + self.intercept - val
+        step = self.learning_rate / (1.0 + data.dot(data))
+        self.scale *= max(0.0, 1.0 - step * self.alpha)
+        if self.scale < 1e-9:
+            # folds the scale into the weights before it underflows.
+            self.v *= self.scale
+            self.scale = 1.0
+        self.v[idxs] -= (step * residual / self.scale) * data
+        self.intercept -= step * residual
+
+    def predict(self, X):
+        return self.scale * X.dot(self.v) + self.intercept
 
 
 class HashingSurrogate(SurrogateModel):
@@ -13,6 +60,28 @@ class HashingSurrogate(SurrogateModel):
     feature representation of the architecture to buckets. See
     :func:`deep_architect.surrogates.common.extract_features` for the functions that is used to
     extract string features for the architectures.
+
+    The strings are hashed with :func:`surrogates.common.stable_hash`, so the
+    same features map to the same buckets across processes. The bucket of
+    each string is memoized, as the same strings appear in many architectures.
+    Integer feature ids, as returned by
+    :class:`surrogates.common.FeatureExtractor` with the same hash seed, are
+    mapped to the same buckets as the corresponding strings.
+
+    By default, a ridge regression model is fit from scratch on all the data
+    every ``refit_interval`` updates, so the total cost grows quadratically
+    with the number of evaluations. In the incremental mode, the model is
+    instead updated with a stochastic gradient step for each new example
+    (see :class:`OnlineRidgeRegressor`), in time proportional to the number
+    of buckets of the example. Its predictions approximate the ones of the
+    default mode. :meth:`refit` is still available to fit the ridge
+    regression model on all the data, as in the default mode.
+
+    With background refitting, the periodic refits are done in a separate
+    thread on a snapshot of the data, and :meth:`update` returns immediately.
+    Predictions keep coming from the previous model until the new one is
+    swapped in. Refits requested while one is running are coalesced into a
+    single refit on the latest data.
     """
 
     def __init__(self,
@@ -21,7 +90,10 @@ class HashingSurrogate(SurrogateModel):
                  weight_decay_coeff=1e-5,
                  use_module_feats=True,
                  use_connection_feats=True,
-                 use_module_hyperp_feats=True):
+                 use_module_hyperp_feats=True,
+                 hash_seed=0,
+                 incremental=False,
+                 background_refit=False):
         self.hash_size = hash_size
         self.refit_interval = refit_interval
         self.weight_decay_coeff = weight_decay_coeff
@@ -31,10 +103,22 @@ class HashingSurrogate(SurrogateModel):
             'module_feats': use_module_feats,
         }
         assert any(itervalues(self.feats_name_to_use_flag))
+        self.hash_seed = hash_seed
+        self.feat_to_idx = {}
         self.vecs_lst = []
         self.vals_lst = []
         # NOTE: using scikit learn for now.
         self.model = None
+        self.incremental = incremental
+        # incremented whenever the predictions of the model change.
+        self.version = 0
+        assert not (incremental and background_refit)
+        self.background_refit = background_refit
+        self.refit_lock = threading.Lock()
+        self.refit_thread = None
+        self.refit_pending = False
+        self.online_model = OnlineRidgeRegressor(
+            hash_size, weight_decay_coeff) if incremental else None
 
     def eval(self, feats):
         if self.model == None:
@@ -43,46 +127,162 @@ class HashingSurrogate(SurrogateModel):
             vec = self._feats2vec(feats)
             return self.model.predict(vec)[0]
 
+    def eval_batch(self, feats_lst):
+        """Same as :meth:`eval` for a list of feature representations, with a
+        single call to the model.
+
+        Returns:
+            numpy.ndarray: Predictions for each of the architectures.
+        """
+        if self.model == None:
+            return np.zeros(len(feats_lst))
+        else:
+            return self.model.predict(self._feats_lst2mat(feats_lst))
+
     def update(self, val, feats):
         vec = self._feats2vec(feats)
         self.vecs_lst.append(vec)
         self.vals_lst.append(val)
-        if len(self.vals_lst) % self.refit_interval == 0:
+        if self.incremental:
+            self._online_update(vec, val)
+        elif len(self.vals_lst) % self.refit_interval == 0:
+            if self.background_refit:
+                self._start_background_refit()
+            else:
+                self._refit()
+
+    def refit(self):
+        """Fits the ridge regression model from scratch on all the data.
+
+        In the incremental mode, predictions come from the ridge regression
+        model until the next update.
+        """
+        if len(self.vals_lst) > 0:
+            self.wait_for_refit()
             self._refit()
 
-    def _feats2vec(self, feats):
-        vec = sp.dok_matrix((1, self.hash_size), dtype='float')
+    def wait_for_refit(self):
+        """Blocks until there are no background refits running."""
+        while True:
+            with self.refit_lock:
+                thread = self.refit_thread
+            if thread is None:
+                return
+            thread.join()
+
+    def _start_background_refit(self):
+        with self.refit_lock:
+            if self.refit_thread is not None:
+                self.refit_pending = True
+            else:
+                self.refit_thread = threading.Thread(
+                    target=self._run_background_refit,
+                    args=(len(self.vals_lst),))
+                self.refit_thread.daemon = True
+                self.refit_thread.start()
+
+    def _run_background_refit(self, num_evals):
+        # the lists are only appended to, so the first num_evals elements are
+        # a consistent snapshot of the data.
+        while True:
+            model = self._fit_model(self.vecs_lst[:num_evals],
+                                    self.vals_lst[:num_evals])
+            with self.refit_lock:
+                self.model = model
+                self.version += 1
+                if not self.refit_pending:
+                    self.refit_thread = None
+                    return
+                self.refit_pending = False
+                num_evals = len(self.vals_lst)
+
+    def _online_update(self, vec, val):
+        self.online_model.update(vec, val)
+        self.model = self.online_model
+        self.version += 1
+
+    def _feats2idxs(self, feats):
+        idxs = []
         for name, fs in iteritems(feats):
             if self.feats_name_to_use_flag[name]:
                 for f in fs:
-                    idx = hash(f) % self.hash_size
-                    vec[0, idx] += 1.0
-        return vec.tocsr()
+                    # integer feature ids, see surrogates.common.FeatureExtractor.
+                    if isinstance(f, integer_types):
+                        idxs.append(f % self.hash_size)
+                        continue
+                    if f not in self.feat_to_idx:
+                        self.feat_to_idx[f] = stable_hash(
+                            f, self.hash_seed) % self.hash_size
+                    idxs.append(self.feat_to_idx[f])
+        return idxs
+
+    def _feats2vec(self, feats):
+        return self._feats_lst2mat([feats])
+
+    def _feats_lst2mat(self, feats_lst):
+        # builds the rows directly in CSR format, with counts for repeated buckets.
+        indptr = [0]
+        indices_lst = []
+        data_lst = []
+        for feats in feats_lst:
+            idxs, counts = np.unique(self._feats2idxs(feats),
+                                     return_counts=True)
+            indices_lst.append(idxs)
+            data_lst.append(counts)
+            indptr.append(indptr[-1] + len(idxs))
+        indices = np.concatenate(indices_lst).astype(np.int32)
+        data = np.concatenate(data_lst).astype('float')
+        return sp.csr_matrix((data, indices, np.array(indptr, dtype=np.int32)),
+                             shape=(len(feats_lst), self.hash_size))
 
     def _refit(self):
-        if self.model == None:
-            self.model = lm.Ridge(alpha=self.weight_decay_coeff)
+        self.model = self._fit_model(self.vecs_lst, self.vals_lst)
+        self.version += 1
 
-        X = sp.vstack(self.vecs_lst, format='csr')
-        y = np.array(self.vals_lst)
-        self.model.fit(X, y)
+    def _fit_model(self, vecs_lst, vals_lst):
+        model = lm.Ridge(alpha=self.weight_decay_coeff)
+        X = sp.vstack(vecs_lst, format='csr')
+        y = np.array(vals_lst)
+        model.fit(X, y)
+        return model
 
     def save_state(self, folder):
-        state = {
-            'num_evals': len(self.vecs_lst),
-            'vals_lst': self.vals_lst,
-        }
-        ut.write_jsonfile(state, os.path.join(folder, 'hash_model_state.json'))
-        for i, vecs in enumerate(self.vecs_lst):
-            sp.save_npz(os.path.join(folder, str(i) + '.npz'), vecs)
+        """Appends the evaluations that are not yet in the store in the folder.
+
+        The data is kept in a :class:`surrogates.storage.SparseRowStore`, so
+        repeated saves to the same folder only write the new evaluations.
+        """
+        store = SparseRowStore(folder, 'hash_model')
+        num_saved = store.read_header()['num_rows']
+        assert num_saved <= len(self.vecs_lst)
+        if num_saved < len(self.vecs_lst):
+            X = sp.vstack(self.vecs_lst[num_saved:], format='csr')
+        else:
+            X = sp.csr_matrix((0, self.hash_size))
+        store.append(X, self.vals_lst[num_saved:])
 
     def load_state(self, folder):
-        state = ut.read_jsonfile(os.path.join(folder, 'hash_model_state.json'))
-        self.vals_lst = state['vals_lst']
-        num_evals = state['num_evals']
-        for i in range(num_evals):
-            self.vecs_lst.append(
+        self.wait_for_refit()
+        store = SparseRowStore(folder, 'hash_model')
+        if store.exists():
+            X, vals = store.load()
+            self.vecs_lst = [X[i] for i in range(X.shape[0])]
+            self.vals_lst = vals.tolist()
+        else:
+            # older layout with one file per evaluation; saving the state
+            # afterwards migrates it to the store.
+            state = ut.read_jsonfile(
+                os.path.join(folder, 'hash_model_state.json'))
+            self.vals_lst = state['vals_lst']
+            self.vecs_lst = [
                 sp.load_npz(os.path.join(folder,
-                                         str(i) + '.npz')))
-        if num_evals > 0:
-            self._refit()
\ No newline at end of file
+                                         str(i) + '.npz'))
+                for i in range(state['num_evals'])
+            ]
+        if self.incremental:
+            self.online_model = OnlineRidgeRegressor(self.hash_size,
+                                                     self.weight_decay_coeff)
+            for vec, val in zip(self.vecs_lst, self.vals_lst):
+                self._online_update(vec, val)
+        elif len(self.vals_lst) > 0:
+            self._refit()
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+import deep_architect.utils as ut
+
+
+class SparseRowStore:
+    """Append-only store for sparse feature rows and their target values.
+
+    The rows are kept in CSR format across four flat binary files (column
+    indices, values, number of nonzeros per row, and targets) that are only
+    ever appended to, so saving costs time proportional to the number of new
+    rows and loading memory-maps the files instead of reading one file per row.
+    A small JSON header with the number of rows and nonzeros is written last
+    (through a rename), so a save interrupted midway leaves the previous
+    contents readable; any trailing bytes past the header are discarded on the
+    next append.
+
+    Args:
+        folder (str): Folder where the files of the store are kept.
+        name (str): Prefix for the names of the files of the store.
+    """
+
+    def __init__(self, folder, name):
+        self.folder = folder
+        self.name = name
+        self.header_filepath = self._get_filepath('header.json')
+        self.filepaths = {
+            'indices': self._get_filepath('indices.bin'),
+            'data': self._get_filepath('data.bin'),
+            'row_nnz': self._get_filepath('row_nnz.bin'),
+            'vals': self._get_filepath('vals.bin'),
+        }
+        self.dtypes = {
+            'indices': np.int32,
+            'data': np.float64,
+            'row_nnz': np.int64,
+            'vals': np.float64,
+        }
+
+    def exists(self):
+        return ut.file_exists(self.header_filepath)
+
+    def read_header(self):
+        if self.exists():
+            return ut.read_jsonfile(self.header_filepath)
+        else:
+            return {'num_rows': 0, 'num_cols': None, 'nnz': 0}
+
+    def append(self, mat, vals):
+        """Appends the rows of a sparse matrix and their target values.
+
+        Args:
+            mat (scipy.sparse.csr_matrix): Rows to append.
+            vals (list[float]): Target values, one per row.
+        """
+        assert mat.shape[0] == len(vals)
+        header = self.read_header()
+        assert header['num_cols'] in (None, mat.shape[1])
+        mat = sp.csr_matrix(mat)
+        arrays = {
+            'indices': mat.indices,
+            'data': mat.data,
+            'row_nnz': np.diff(mat.indptr),
+            'vals': np.asarray(vals),
+        }
+        sizes = {
+            'indices': header['nnz'],
+            'data': header['nnz'],
+            'row_nnz': header['num_rows'],
+            'vals': header['num_rows'],
+        }
+        for k, arr in arrays.items():
+            dtype = np.dtype(self.dtypes[k])
+            with open(self.filepaths[k], 'ab') as f:
+                f.truncate(sizes[k] * dtype.itemsize)
+                f.write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        tmp_filepath = self.header_filepath + '.tmp'
+        ut.write_jsonfile(
+            {
+                'num_rows': header['num_rows'] + mat.shape[0],
+                'num_cols': mat.shape[1],
+                'nnz': header['nnz'] + mat.nnz
+            }, tmp_filepath)
+        os.rename(tmp_filepath, self.header_filepath)
+
+    def load(self):
+        """Returns the rows and the target values in the store.
+
+        The arrays are memory-mapped, so only the parts that are used are read.
+
+        Returns:
+            (scipy.sparse.csr_matrix, numpy.ndarray): The rows and the targets.
+        """
+        header = self.read_header()
+        num_rows = header['num_rows']
+        nnz = header['nnz']
+        arrays = {}
+        for k, size in [('indices', nnz), ('data', nnz), ('row_nnz', num_rows),
+                        ('vals', num_rows)]:
+            if size > 0:
+                arrays[k] = np.memmap(self.filepaths[k],
+                                      dtype=self.dtypes[k],
+                                      mode='r',
+                                      shape=(size,))
+            else:
+                arrays[k] = np.zeros(0, dtype=self.dtypes[k])
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(arrays['row_nnz'], out=indptr[1:])
+        mat = sp.csr_matrix((arrays['data'], arrays['indices'], indptr),
+                            shape=(num_rows, header['num_cols'] or 0))
+        return mat, arrays['vals']
+
+    def _get_filepath(self, filename):
+        return os.path.join(self.folder, '%s_%s' % (self.name, filename))